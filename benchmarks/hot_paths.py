@@ -0,0 +1,253 @@
+"""Benchmark of the calendar hot paths, run without a browser.
+
+Measures the Easter calculation, the construction and the sorted views of `Holidays`,
+the holidays query on a SQLite database prefilled with some years, the bulk insert of
+the holidays and the rendering of the calendar (`update_content` and `day_container`)
+on a fake Flet page. The holiday store is not used, so the calendar reads the database.
+
+The results are written to a JSON file, and a previous file can be given to compare
+both runs: a case whose best time grew more than the tolerance is a regression (the
+best round is the least affected by the other processes of the machine).
+
+Usage:
+    python benchmarks/hot_paths.py [--years 20] [--runs 5] [--output results.json]
+                                   [--compare baseline.json] [--tolerance 0.25]
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import timeit
+from datetime import date, datetime
+
+root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIRST_YEAR = 2000
+"""First year saved on the benchmark database."""
+
+
+class FakePage:
+    """Page that accepts the updates of the calendar without a Flet client."""
+    session_id = 'benchmark'
+
+    def __init__(self):
+        self.updates = 0
+
+
+    def update(self, *controls):
+        self.updates += 1
+
+
+    def open(self, control):
+        pass
+
+
+    def close(self, control):
+        pass
+
+
+def measure(function, number: int, runs: int) -> dict:
+    """Times a function like `timeit`: `runs` rounds of `number` calls.
+
+    Arguments:
+        function (callable): Function without arguments.
+        number (int): Calls per round.
+        runs (int): Number of rounds.
+
+    Returns:
+        dict: Seconds per call of the best, median and worst rounds.
+    """
+    times = [total / number for total in timeit.Timer(function).repeat(repeat=runs, number=number)]
+    return {'number': number,
+            'runs': runs,
+            'min': min(times),
+            'median': statistics.median(times),
+            'max': max(times)}
+
+
+def cases(years: int, runs: int) -> dict:
+    """Runs every case of the benchmark.
+
+    Arguments:
+        years (int): Years saved on the database before the queries.
+        runs (int): Rounds of each case.
+
+    Returns:
+        dict: Result of `measure` by case name.
+    """
+    import db.connection as dbconn
+    import db.database as db
+    import db.upgrade as upgrade
+    from ui.calendar import Calendar
+    from utils.holiday_rules import calc_easter_range, holiday_rules
+    from utils.holidays import Holidays, calc_easter
+
+    upgrade.init_database(dbconn.engine)
+    rules = holiday_rules()
+    results = {}
+
+    def easter_years():
+        for year in range(1900, 2101):
+            calc_easter(year)
+
+    results['calc_easter (1900-2100)'] = measure(easter_years, 100, runs)
+    results['calc_easter_range (1900-2100)'] = measure(lambda: calc_easter_range(1900, 2100),
+                                                       100, runs)
+
+    for city in rules.cities.values():
+        results[f'Holidays ({city.name})'] = measure(
+            lambda: Holidays(2024, city.id, city.has_adm_decisions), 100, runs)
+
+    holidays = Holidays(2024, 1, True)
+
+    def rebuilt_views():
+        holidays.views = None
+        holidays.sorted, holidays.sorted_local, holidays.sorted_national
+
+    results['Holidays.sorted* (recriadas)'] = measure(rebuilt_views, 1000, runs)
+    results['Holidays.sorted* (em cache)'] = measure(
+        lambda: (holidays.sorted, holidays.sorted_local, holidays.sorted_national), 10000, runs)
+
+    calendar = Calendar(FIRST_YEAR, 6, 1, True) # the 42 days are all of FIRST_YEAR
+    calendar.page = FakePage()
+    calendar.prefetch_neighbours = lambda: None # only the render is measured
+
+    with db.session_scope() as session:
+        for year in range(FIRST_YEAR, FIRST_YEAR + years):
+            calendar.save_holidays_db(session, year)
+
+        # Insert of years not saved yet, with the layers generated beforehand
+        new_years = iter(range(FIRST_YEAR + years, FIRST_YEAR + years + 10 * runs))
+        for year in range(FIRST_YEAR + years, FIRST_YEAR + years + 10 * runs):
+            Holidays.layers(year)
+        results['save_holidays_db (ano novo)'] = measure(
+            lambda: calendar.save_holidays_db(session, next(new_years)), 10, runs)
+
+        # Insert of years not saved yet, generating the layers
+        cold_years = iter(range(FIRST_YEAR + years + 10 * runs, FIRST_YEAR + years + 20 * runs))
+        results['save_holidays_db (ano novo, gerando as camadas)'] = measure(
+            lambda: calendar.save_holidays_db(session, next(cold_years)), 10, runs)
+
+        national = Holidays.layers(FIRST_YEAR)[0]
+        results['save_holidays_dict_db (conflitos)'] = measure(
+            lambda: calendar.save_holidays_dict_db(session, national, 0), 10, runs)
+
+        months = [(FIRST_YEAR + i % years, i % 12 + 1) for i in range(12 * years)]
+
+        def query_months(city_id: int, has_adm_decisions: bool):
+            for year, month in months:
+                start_date, end_date = calendar.grid_dates(year, month)
+                db.get_holidays(session, city_id, has_adm_decisions, start_date, end_date)
+
+        results[f'get_holidays ({years} anos, cidade 1)'] = measure(
+            lambda: query_months(1, True), 1, runs)
+        results[f'get_holidays ({years} anos, cidade 3, sem decisões)'] = measure(
+            lambda: query_months(3, False), 1, runs)
+
+    calendar.update_content()
+
+    def render_database():
+        calendar.grid_cache.clear()
+        calendar.update_content()
+
+    results['update_content (banco)'] = measure(render_database, 20, runs)
+
+    shown = [(FIRST_YEAR, 5), (FIRST_YEAR, 6)]
+
+    def render_cached():
+        for year, month in shown:
+            calendar.year, calendar.month = year, month
+            calendar.update_content()
+
+    render_cached()
+    results['update_content (cache, 2 meses)'] = measure(render_cached, 50, runs)
+
+    start_date, _ = calendar.grid_dates(FIRST_YEAR, 5)
+    with db.session_scope() as session:
+        holidays_list = calendar.month_holidays(session, FIRST_YEAR, 5, 1, True)
+    days = [date.fromordinal(start_date.toordinal() + i) for i in range(calendar.grid_items)]
+
+    def containers():
+        for i, day in enumerate(days):
+            calendar.day_container(day, holidays_list, False, calendar.cells[i])
+
+    results['day_container (42 dias)'] = measure(containers, 100, runs)
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> bool:
+    """Prints the change of each case against a previous run.
+
+    Arguments:
+        results (dict): Cases of this run.
+        baseline (dict): Cases of the previous run.
+        tolerance (float): Relative growth of the best time accepted, e.g. 0.25 for 25%.
+
+    Returns:
+        bool: `True` if no case regressed.
+    """
+    passed = True
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            print(f'{name}: sem referência')
+            continue
+        ratio = result['min'] / previous['min'] if previous['min'] else float('inf')
+        regressed = ratio > 1 + tolerance
+        passed = passed and not regressed
+        print(f'{name}: {previous["min"] * 1e3:.3f} ms -> {result["min"] * 1e3:.3f} ms '
+              f'({ratio:.2f}x){" REGRESSÃO" if regressed else ""}')
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mede os pontos críticos do calendário.')
+    parser.add_argument('--years', type=int, default=20,
+                        help='Anos salvos no banco antes das consultas.')
+    parser.add_argument('--runs', type=int, default=5, help='Rodadas de cada caso.')
+    parser.add_argument('--output', help='Arquivo JSON onde os resultados são salvos.')
+    parser.add_argument('--compare', help='Arquivo JSON de uma execução anterior.')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Aumento máximo do melhor tempo em relação à execução anterior.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Set before the application modules are imported
+        os.environ['LACTEC_DB_TYPE'] = 'sqlite'
+        os.environ['LACTEC_DB_URL'] = f"sqlite:///{os.path.join(tmp, 'benchmark.db')}"
+        os.environ['LACTEC_HOLIDAY_STORE'] = os.path.join(tmp, 'holiday_store')
+        sys.path.insert(0, root_path)
+        results = cases(args.years, args.runs)
+
+        import db.connection as dbconn
+        dbconn.engine.dispose()
+
+    for name, result in results.items():
+        print(f'{name}: mediana {result["median"] * 1e3:.3f} ms, '
+              f'mín {result["min"] * 1e3:.3f} ms, máx {result["max"] * 1e3:.3f} ms')
+
+    run = {'date_hour': datetime.now().isoformat(timespec='seconds'),
+           'python': platform.python_version(),
+           'platform': platform.platform(),
+           'years': args.years,
+           'results': results}
+    if args.output:
+        with open(args.output, mode='w', encoding='utf-8') as file_ref:
+            json.dump(run, file_ref, indent=2, ensure_ascii=False)
+
+    passed = True
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file_ref:
+            baseline = json.load(file_ref)
+        print()
+        passed = compare(results, baseline['results'], args.tolerance)
+        if not passed:
+            print(f'FALHA: casos mais lentos que a tolerância ({args.tolerance:.0%})')
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Startup time benchmark.
+
+Measures, in fresh interpreters, the time to import the application (`import main`)
+and the time of the one-time database init step (`upgrade.init_database`) on a new
+SQLite file. Fails if the median import time exceeds the budget or if a module that
+must be loaded lazily (e.g. pandas) is imported at startup.
+
+Usage:
+    python benchmarks/startup.py [--runs 5] [--budget 1.5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LAZY_MODULES = ('pandas', 'pdb', 'pprintpp')
+"""Modules that must not be imported when the application starts."""
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed,
+                  "loaded": [name for name in %r if name in sys.modules]}))
+""" % (LAZY_MODULES,)
+
+INIT_SCRIPT = """
+import json, time
+import db.connection as dbconn
+import db.upgrade as upgrade
+start = time.perf_counter()
+upgrade.init_database(dbconn.engine)
+print(json.dumps({"seconds": time.perf_counter() - start}))
+"""
+
+
+def run(script: str, env: dict) -> dict:
+    """Runs a script in a fresh interpreter and returns its JSON output."""
+    result = subprocess.run([sys.executable, '-c', script],
+                            cwd=root_path,
+                            env=env,
+                            capture_output=True,
+                            text=True,
+                            check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mede o tempo de inicialização da aplicação.')
+    parser.add_argument('--runs', type=int, default=5, help='Número de execuções.')
+    parser.add_argument('--budget', type=float, default=1.5,
+                        help='Tempo máximo, em segundos, da importação (mediana).')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env['LACTEC_DB_TYPE'] = 'sqlite'
+        env['LACTEC_DB_URL'] = f"sqlite:///{os.path.join(tmp, 'startup.db')}"
+
+        imports = [run(IMPORT_SCRIPT, env) for _ in range(args.runs)]
+        init = run(INIT_SCRIPT, env)
+
+    import_times = [result['seconds'] for result in imports]
+    loaded = sorted({name for result in imports for name in result['loaded']})
+    median = statistics.median(import_times)
+
+    print(f'import main: mediana {median:.3f} s, '
+          f'mín {min(import_times):.3f} s, máx {max(import_times):.3f} s '
+          f'(orçamento {args.budget:.3f} s)')
+    print(f'init_database (banco novo): {init["seconds"]:.3f} s')
+
+    failed = False
+    if median > args.budget:
+        print(f'FALHA: importação acima do orçamento ({median:.3f} s > {args.budget:.3f} s)')
+        failed = True
+    if loaded:
+        print(f'FALHA: módulos carregados na inicialização: {", ".join(loaded)}')
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
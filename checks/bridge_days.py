@@ -0,0 +1,81 @@
+"""Equivalence check of the bridge-day resolver.
+
+Compares `utils.bridge_days.resolve_bridge_days`, as used by `Holidays` and by
+`HolidayRules.evaluate`, with the former bridge-day algorithm of `Holidays`, which
+iterates the holidays while adding the bridge days and searches each holiday by
+reason, for every year of the range and every city of the holiday rules. Exits with
+an error if any year differs.
+
+Usage:
+    python checks/bridge_days.py [--start 1900] [--end 2100]
+"""
+import argparse
+import os
+import sys
+
+root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root_path)
+
+from db.models import HolidayType
+from utils.holiday_rules import holiday_rules
+from utils.holidays import Holidays
+
+ADMINISTRATIVE = HolidayType.ADMINISTRATIVE_DECISION
+
+
+def former_holidays(year: int, city: int) -> Holidays:
+    """Generates the holidays of a year with the former bridge-day algorithm."""
+    holidays = Holidays(year, city, False)
+    holidays.add_rules(holidays.rules.administrative)
+    for holiday in holidays.holidays: # grows while bridge days are added
+        if holiday.type_code == ADMINISTRATIVE.code or holiday.weekday > 4:
+            continue
+        if holiday.reason not in holidays.bridge_excluded:
+            holidays.add_bridge_day(holiday.reason, ADMINISTRATIVE, holiday.is_local)
+    return holidays
+
+
+def rows(records) -> list:
+    """Returns the (ordinal, reason, type code, is local) of the records."""
+    return [(record.ordinal, record.reason, record.type_code, record.is_local)
+            for record in records]
+
+
+def differences(start_year: int, end_year: int) -> list:
+    """Returns the (city, year) whose holidays differ from the former algorithm."""
+    rules = holiday_rules()
+    found = []
+    for city in rules.cities:
+        columns = rules.evaluate(start_year, end_year, [city], True)
+        reasons = columns['reasons']
+        by_year = {}
+        for year, ordinal, reason, type, is_local in zip(columns['year'].tolist(),
+                                                         columns['ordinal'].tolist(),
+                                                         columns['reason'].tolist(),
+                                                         columns['type'].tolist(),
+                                                         columns['is_local'].tolist()):
+            by_year.setdefault(year, []).append((ordinal, reasons[reason], type, is_local))
+
+        for year in range(start_year, end_year + 1):
+            expected = rows(former_holidays(year, city).sorted)
+            if rows(Holidays(year, city, True).sorted) != expected or \
+                    by_year.get(year, []) != expected:
+                found.append((city, year))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compara os dias ponte com o algoritmo anterior.')
+    parser.add_argument('--start', type=int, default=1900, help='Primeiro ano.')
+    parser.add_argument('--end', type=int, default=2100, help='Último ano.')
+    args = parser.parse_args()
+
+    found = differences(args.start, args.end)
+    for city, year in found:
+        print(f'Dias ponte diferentes: cidade {city}, ano {year}')
+    print(f'{len(found)} diferenças de {args.start} a {args.end}')
+    sys.exit(1 if found else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Query plan check of the holidays query.
+
+Prefills a temporary SQLite database with some years of holidays and checks that the
+`get_holidays` queries (with and without the administrative decisions) search the
+holiday table by the `(group, date, type)` index. Exits with an error if they do not.
+
+Usage:
+    python checks/query_plan.py [--years 20]
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIRST_YEAR = 2000
+"""First year saved on the temporary database."""
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Verifica o plano da consulta de feriados.')
+    parser.add_argument('--years', type=int, default=20,
+                        help='Anos salvos no banco antes da verificação.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Set before the application modules are imported
+        os.environ['LACTEC_DB_TYPE'] = 'sqlite'
+        os.environ['LACTEC_DB_URL'] = f"sqlite:///{os.path.join(tmp, 'query_plan.db')}"
+        os.environ['LACTEC_HOLIDAY_STORE'] = os.path.join(tmp, 'holiday_store')
+        sys.path.insert(0, root_path)
+
+        from sqlalchemy import text
+
+        import db.connection as dbconn
+        import db.database as db
+        import db.upgrade as upgrade
+        from prewarm import prewarm
+
+        prewarm(FIRST_YEAR, FIRST_YEAR + args.years - 1, workers=1)
+        with db.session_scope() as session:
+            session.execute(text('ANALYZE'))
+            for has_adm_decisions in [True, False]:
+                plan = upgrade.holidays_query_plan(session, 1, has_adm_decisions)
+                print(f'Decisões administrativas {has_adm_decisions}: {"; ".join(plan)}')
+            passed = upgrade.check_query_plan(session)
+        dbconn.engine.dispose()
+
+    if not passed:
+        print('FALHA: a consulta de feriados não usa o índice ix_holiday_group_date_type')
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+from typing import Any, List, Optional, Union, Callable
+
+import threading
+
+import db.database as db
+
+
+class ConfigService:
+    """Read-only, in-memory copy of the `Config` row, the defaults of the preferences of
+    the sessions (see `ui.preferences.Preferences`).
+
+    The row is loaded once and the reads are served from memory.
+    """
+    fields = ('dark_theme', 'window_width', 'window_height',
+              'window_top', 'window_left', 'city_id')
+
+    def __init__(self):
+        self.values = None
+        self.lock = threading.RLock()
+
+
+    def load(self):
+        """Loads the `Config` row, if it was not loaded yet."""
+        with self.lock:
+            if self.values is not None:
+                return
+            with db.session_scope() as session:
+                reg = db.get_config(session)
+                self.values = {field: getattr(reg, field) for field in self.fields}
+
+
+    def get(self, name: str) -> Any:
+        """Returns a configuration value.
+
+        Arguments:
+            name (str): Name of the `Config` column.
+        """
+        self.load()
+        return self.values[name]
+
+
+config_service = ConfigService()
+"""Configuration shared by the whole process."""
@@ -1,47 +1,58 @@
 from contextlib import contextmanager
-from datetime import date, datetime
-from sqlalchemy import func, and_, desc
+from datetime import date, datetime, timedelta
+from sqlalchemy import func, and_, desc, insert
 from sqlalchemy.orm import Session
 from typing import Any, List, Optional, Union, Callable
 
-import pandas as pd
-import pdb
-
 from db.connection import SessionLocal
+from db.log_writer import log_writer
 from db.models import *
 from utils import utils
+from utils.holiday_rules import holiday_rules
+from utils.stats import stats, traced
 
 
 @contextmanager
 def session_scope():
     """Provide a transactional scope around a series of operations."""
-    session = SessionLocal()
-    try:
-        yield session
-        # session.commit()
-    except:
-        session.rollback()
-        raise
-    finally:
-        session.close()
+    with stats.span('session_scope'):
+        session = SessionLocal()
+        try:
+            yield session
+            # session.commit()
+        except:
+            session.rollback()
+            raise
+        finally:
+            session.close()
 
 
 def get_cities(session: Session) -> List[City]:
+    """Returns the cities, first adding the cities of the holiday rules missing in the table.
+
+    Args:
+        session (Session): Database session.
+
+    Returns:
+        City list: The cities, ordered by id. The id of a city is also its holidays group.
+    """
     try:
         regs = session.query(City).order_by(City.id).all()
-        if len(regs) == 0:
-            city1 = City(name='Curitiba/PR')
-            city2 = City(name='Salvador/BA')
-            city3 = City(name='Navegantes/SC',
-                         has_adm_decisions=False)
-            save_object(session, city1)
-            save_object(session, city2)
-            save_object(session, city3)
-            return [city1, city2, city3]
+        saved = {reg.id for reg in regs}
+        new_cities = [City(id=city.id,
+                           name=city.name,
+                           has_adm_decisions=city.has_adm_decisions)
+                      for city in holiday_rules().cities.values()
+                      if city.id not in saved]
+        if len(new_cities) > 0:
+            session.add_all(new_cities)
+            session.commit()
+            regs = session.query(City).order_by(City.id).all()
         
         return regs
 
     except Exception as e:
+        session.rollback()
         save_log_message(session, LogType.ERROR, e)
 
 
@@ -69,46 +80,68 @@ def get_first_year_holiday(session: Session,
 
 def get_month_holidays(session: Session,
                        city_id: int,
-                       year_month: str) -> List[Holiday]:
+                       year_month: str,
+                       has_adm_decisions: bool = True) -> List[Holiday]:
     try:
-        regs = session.query(Holiday).filter(and_(\
-            Holiday.city_id == city_id,
-            Holiday.year_month == year_month)).\
-            order_by(Holiday.date).all()
-        return regs
+        year, month = int(year_month[:4]), int(year_month[4:])
+        start_date = date(year, month, 1)
+        end_date = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+        return get_holidays(session,
+                            city_id,
+                            has_adm_decisions,
+                            start_date,
+                            end_date)
 
     except Exception as e:
         save_log_message(session, LogType.ERROR, e)
 
 
+def holidays_query(session: Session,
+                   group: int,
+                   has_adm_decisions: bool,
+                   start_date: date,
+                   end_date: date):
+    """Builds the query of the holidays of a city's group between two dates.
+
+    The filters follow the `(group, date, type)` index of the holiday table. The
+    holidays are ordered by date, the city's group (local holidays) first.
+    """
+    if group == 0:
+        groups = [0]
+    else:
+        groups = [0, group]
+
+    if has_adm_decisions:
+        query = session.query(Holiday).filter(and_(\
+            Holiday.group.in_(groups),
+            Holiday.date.between(start_date, end_date)))
+    else:
+        query = session.query(Holiday).filter(and_(\
+            Holiday.group.in_(groups),
+            Holiday.date.between(start_date, end_date),
+            Holiday.type != HolidayType.ADMINISTRATIVE_DECISION))
+    # The local holiday comes first when a day is also a national holiday or bridge day
+    return query.order_by(Holiday.date, Holiday.group.desc(), Holiday.id)
+
+
 def get_holidays(session: Session,
                  group: int,
                  has_adm_decisions: bool,
                  start_date: date,
                  end_date: date):
     try:
-        if group == 0:
-            groups = [0]
-        else:
-            groups = [0, group]
-
-        if has_adm_decisions:
-            regs = session.query(Holiday).filter(and_(\
-                Holiday.group.in_(groups),
-                Holiday.date.between(start_date, end_date))).\
-                order_by(Holiday.date).all()
-        else:
-            regs = session.query(Holiday).filter(and_(\
-                Holiday.group.in_(groups),
-                Holiday.type != HolidayType.ADMINISTRATIVE_DECISION,
-                Holiday.date.between(start_date, end_date))).\
-                order_by(Holiday.date).all()
+        regs = holidays_query(session,
+                              group,
+                              has_adm_decisions,
+                              start_date,
+                              end_date).all()
         return regs
 
     except Exception as e:
         save_log_message(session, LogType.ERROR, e)
 
 
+@traced('get_config')
 def get_config(session: Session) -> Config:
     try:
         reg = session.query(Config).first()
@@ -127,81 +160,104 @@ def get_config(session: Session) -> Config:
         save_log_message(session, LogType.ERROR, e)
 
 
-def set_theme(session: Session,
-              dark_theme: bool):
+def save_object(session: Session, obj):
     try:
-        reg = get_config(session)
-        reg.dark_theme = dark_theme
-        save_object(session, reg)
+        session.add(obj)
+        session.commit()
     
     except Exception as e:
+        session.rollback()
         save_log_message(session, LogType.ERROR, e)
 
 
-def set_city_id(session: Session,
-              city_id: int):
+def save_objects(session: Session, object_list):
     try:
-        reg = get_config(session)
-        reg.city_id = city_id
-        save_object(session, reg)
+        session.bulk_save_objects(object_list)
+        session.commit()
     
     except Exception as e:
+        session.rollback()
         save_log_message(session, LogType.ERROR, e)
 
 
-def set_page_window(session: Session,
-                    width: float,
-                    height: float,
-                    top: float,
-                    left: float):
-    try:
-        reg = get_config(session)
-        reg.window_width = width
-        reg.window_height = height
-        reg.window_top = top
-        reg.window_left = left
-        save_object(session, reg)
-    
-    except Exception as e:
-        save_log_message(session, LogType.ERROR, e)
+def insert_holidays(session: Session,
+                    rows: List[dict]):
+    """Inserts holidays in a single `INSERT ... ON CONFLICT DO NOTHING` statement.
 
+    The rows already saved (same group, date and reason) are skipped, so two sessions
+    generating the same year at the same time do not duplicate the holidays. The
+    databases without `ON CONFLICT` (neither SQLite nor PostgreSQL) use
+    `insert_missing_holidays`.
 
-def save_object(session: Session, obj):
+    Arguments:
+        session (Session): Database session.
+        rows (dict list): Holidays with the keys `date`, `reason`, `type` and `group`.
+    """
     try:
-        session.add(obj)
+        if len(rows) == 0:
+            return
+        dialect = session.get_bind().dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            insert_missing_holidays(session, rows)
+            return
+
+        statement = insert(Holiday).on_conflict_do_nothing(
+            index_elements=list(Holiday.unique_columns))
+        session.execute(statement, rows)
         session.commit()
-    
+
     except Exception as e:
         session.rollback()
         save_log_message(session, LogType.ERROR, e)
 
 
-def save_objects(session: Session, object_list):
-    try:
-        session.bulk_save_objects(object_list)
-        session.commit()
-    
-    except Exception as e:
-        session.rollback()
-        save_log_message(session, LogType.ERROR, e)
+def insert_missing_holidays(session: Session,
+                            rows: List[dict]):
+    """Inserts the holidays not saved yet with a plain `INSERT`, for the databases
+    without `ON CONFLICT`.
+
+    The saved holidays of the groups and dates of the rows are read first, in a single
+    query. A row saved by another session in the meantime fails the unique index and
+    rolls the insert back, like any other error of `insert_holidays`.
+
+    Arguments:
+        session (Session): Database session.
+        rows (dict list): Holidays with the keys `date`, `reason`, `type` and `group`.
+    """
+    saved = set(session.query(Holiday.group, Holiday.date, Holiday.reason).filter(and_(\
+        Holiday.group.in_({row['group'] for row in rows}),
+        Holiday.date.between(min(row['date'] for row in rows),
+                             max(row['date'] for row in rows)))).all())
+    new_rows = []
+    for row in rows:
+        key = (row['group'], row['date'], row['reason'])
+        if key not in saved:
+            saved.add(key)
+            new_rows.append(row)
+
+    if len(new_rows) > 0:
+        session.execute(insert(Holiday), new_rows)
+    session.commit()
 
 
 def save_log_message(session: Session, 
                      log_type: LogType, 
                      e: Exception):
-    """Save the log message on the database.
+    """Queues the log message to be saved on the database by the background log writer.
 
     Args:
+        session (Session): Kept for compatibility, the writer uses its own sessions.
         log_type (str): Log message type: DEBUG, INFO, ERROR, WARNING, CRITICAL.
-        description (str): The log message.
+        e (Exception): The error to be logged.
     """
     try:
         description = utils.error_handling(e)
         datetime_now = datetime.now() # + timedelta(seconds=cfg.app.time_shift)
-        log = Log(date_hour=datetime_now,
-                  log_type=log_type,
-                  description=description)
-        save_object(session, log)
+        log_writer.write(log_type, description, datetime_now)
 
     except Exception as e:
         print(f'Erro ao salvar o log: {e}')
@@ -0,0 +1,173 @@
+from datetime import datetime, timedelta
+from sqlalchemy import delete, insert, select
+from typing import Any, List, Optional, Union, Callable
+
+import atexit
+import queue
+import threading
+import time
+
+from db.connection import SessionLocal
+from db.models import Log, LogType
+
+
+class LogWriter:
+    """Writes the log messages to the `Log` table on a background thread.
+
+    The messages wait in a bounded queue and are inserted in batches, one commit per
+    batch. When the queue is full the new messages are dropped and counted, so an error
+    storm does not turn into a write storm. The old rows are removed periodically by age
+    and by row count.
+
+    Arguments:
+        max_queue (int, optional): Maximum number of messages waiting to be written.
+        batch_size (int, optional): Maximum number of messages written per commit.
+        max_age_days (int, optional): Age, in days, of the rows removed by the retention.
+        max_rows (int, optional): Number of most recent rows kept by the retention.
+        retention_interval (float, optional): Seconds between two retention runs.
+    """
+    def __init__(self,
+                 max_queue: int = 1000,
+                 batch_size: int = 100,
+                 max_age_days: int = 90,
+                 max_rows: int = 100000,
+                 retention_interval: float = 3600.0):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.max_age_days = max_age_days
+        self.max_rows = max_rows
+        self.retention_interval = retention_interval
+        self.last_retention = 0.0
+        self.thread = None
+        self.lock = threading.Lock()
+        """Guards the writer thread and the counters, updated by many threads."""
+        self.written = 0
+        """Messages written to the database."""
+        self.dropped = 0
+        """Messages dropped because the queue was full."""
+        self.failed = 0
+        """Messages lost because their batch could not be written."""
+
+
+    def start(self):
+        """Starts the writer thread, if not started yet."""
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run,
+                                               name='log-writer',
+                                               daemon=True)
+                self.thread.start()
+
+
+    def write(self,
+              log_type: LogType,
+              description: str,
+              date_hour: Optional[datetime] = None) -> bool:
+        """Queues a log message. Never blocks.
+
+        Arguments:
+            log_type (:obj:`LogType`): Log message type.
+            description (str): The log message.
+            date_hour (datetime, optional): Date and time of the message. The default is now.
+
+        Returns:
+            bool: `False` if the message was dropped.
+        """
+        self.start()
+        row = {"date_hour": date_hour or datetime.now(),
+               "log_type": log_type,
+               "description": description[:800]}
+        try:
+            self.queue.put_nowait(row)
+            return True
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            return False
+
+
+    def run(self):
+        """Loop of the writer thread."""
+        while True:
+            try:
+                batch = [self.queue.get(timeout=self.retention_interval)]
+            except queue.Empty:
+                batch = []
+            while batch and len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if batch:
+                self.write_batch(batch)
+                for _ in batch:
+                    self.queue.task_done()
+
+            if time.monotonic() - self.last_retention >= self.retention_interval:
+                self.apply_retention()
+
+
+    def write_batch(self, batch: List[dict]):
+        """Inserts a batch of messages in a single statement and commit.
+
+        Arguments:
+            batch (dict list): Rows of the `Log` table.
+        """
+        session = SessionLocal()
+        try:
+            session.execute(insert(Log), batch)
+            session.commit()
+            with self.lock:
+                self.written += len(batch)
+        except Exception as e:
+            session.rollback()
+            with self.lock:
+                self.failed += len(batch)
+            print(f'Erro ao salvar o log: {e}')
+        finally:
+            session.close()
+
+
+    def apply_retention(self):
+        """Removes the rows older than `max_age_days` and beyond the `max_rows` most recent."""
+        self.last_retention = time.monotonic()
+        session = SessionLocal()
+        try:
+            limit = datetime.now() - timedelta(days=self.max_age_days)
+            session.execute(delete(Log).where(Log.date_hour < limit))
+
+            last_kept = session.execute(
+                select(Log.date_hour).
+                order_by(Log.date_hour.desc()).
+                offset(self.max_rows - 1).
+                limit(1)).scalar()
+            if last_kept is not None:
+                session.execute(delete(Log).where(Log.date_hour < last_kept))
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            print(f'Erro ao aplicar a retenção do log: {e}')
+        finally:
+            session.close()
+
+
+    def flush(self):
+        """Waits until every queued message is written."""
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.join()
+
+
+    def info(self) -> dict:
+        """Returns the writer counters and the current queue size."""
+        with self.lock:
+            return {"written": self.written,
+                    "dropped": self.dropped,
+                    "failed": self.failed,
+                    "queued": self.queue.qsize()}
+
+
+log_writer = LogWriter()
+"""Log writer shared by the whole process."""
+
+atexit.register(log_writer.flush)
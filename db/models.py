@@ -1,8 +1,9 @@
 from db.connection import Base
 from datetime import datetime, date
 from sqlalchemy import Column, ForeignKey, Enum, Table
-from sqlalchemy import Integer, String, Boolean, Date, DateTime, Float, Enum
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import Integer, SmallInteger, String, Boolean, Date, DateTime, Float, Enum
+from sqlalchemy import Index, UniqueConstraint
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.orm import Mapped
 from sqlalchemy.orm import mapped_column
@@ -18,6 +19,32 @@ class HolidayType(enum.Enum):
     MOBILE_HOLIDAY = 'Feriado móvel'
     ADMINISTRATIVE_DECISION = 'Decisão administrativa'
 
+    @property
+    def code(self) -> int:
+        """Compact integer code of the holiday type."""
+        return HOLIDAY_TYPE_CODES[self]
+
+
+HOLIDAY_TYPES = tuple(HolidayType)
+"""Holiday types indexed by their compact integer code."""
+HOLIDAY_TYPE_CODES = {type: code for code, type in enumerate(HOLIDAY_TYPES)}
+
+
+class HolidayTypeCode(TypeDecorator):
+    """Column type that stores a `HolidayType` as its compact integer code."""
+    impl = SmallInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return value.code
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return HOLIDAY_TYPES[value]
+
 
 class LogType(enum.Enum):
     DEBUG = 'Debug'
@@ -37,15 +64,21 @@ class City(Base):
 
 class Holiday(Base):
     __tablename__ = 'holiday'
+    __table_args__ = (
+        Index('ix_holiday_group_date_type', 'group', 'date', 'type'),
+        Index('ux_holiday_group_date_reason', 'group', 'date', 'reason', unique=True),
+    )
+    unique_columns = ('group', 'date', 'reason')
+    """Columns of the unique index: a holiday is saved only once per group."""
 
     id: Mapped[int] = mapped_column(primary_key=True)
     date: Mapped[Date] = mapped_column(Date)
-    year_month: Mapped[str] = mapped_column(String(6))
     reason: Mapped[str] = mapped_column(String(120))
-    type: Mapped[HolidayType] = mapped_column(Enum(HolidayType))
+    type: Mapped[HolidayType] = mapped_column(HolidayTypeCode)
+    """Holiday type, stored as `HolidayType.code`."""
     
     group: Mapped[int] = mapped_column(Integer)
-    """Group: 0 - All cities, 1 - Curitiba, 2 - Salvador"""
+    """Group: 0 - All cities, 1 - Curitiba, 2 - Salvador, 3 - Navegantes"""
 
 
 class Config(Base):
@@ -67,7 +100,7 @@ class Log(Base):
     id: Mapped[int] = mapped_column(primary_key=True)
     """Log ID number, primary key."""
 
-    date_hour: Mapped[datetime] = mapped_column(DateTime)
+    date_hour: Mapped[datetime] = mapped_column(DateTime, index=True)
     """Log's date and time."""
     log_type: Mapped[LogType] = mapped_column(Enum(LogType))
     """The Log's message type: DEBUG, INFO, ERROR, WARNING, CRITICAL."""
@@ -0,0 +1,200 @@
+from datetime import date
+from sqlalchemy import Integer, cast, func, inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from typing import Any, List, Optional, Union, Callable
+
+import numpy as np
+
+from db.models import Holiday, HolidayType, HOLIDAY_TYPES
+from utils.holiday_rules import holiday_rules
+from utils.holidays import Holidays
+import db.database as db
+
+
+def holiday_table_is_current(engine: Engine) -> bool:
+    """Checks if the `holiday` table already has the compact schema.
+
+    Arguments:
+        engine (Engine): Database engine.
+
+    Returns:
+        bool: `False` if the table still has the `year_month` column or stores the type
+            as text.
+    """
+    columns = {column['name']: column for column in inspect(engine).get_columns('holiday')}
+    if 'year_month' in columns:
+        return False
+    return columns['type']['type'].python_type is int
+
+
+def upgrade_holiday_table(engine: Engine):
+    """Rebuilds an old `holiday` table in place with the compact schema.
+
+    The `year_month` column is dropped and the type names are converted to their
+    integer codes. The holiday ids are kept, except for the duplicated holidays,
+    of which only the oldest row is copied.
+
+    Arguments:
+        engine (Engine): Database engine.
+    """
+    table = Holiday.__table__
+    cases = ' '.join(f"WHEN '{type.name}' THEN {type.code}" for type in HOLIDAY_TYPES)
+    with engine.begin() as conn:
+        conn.execute(text('ALTER TABLE holiday RENAME TO holiday_old'))
+        table.create(conn)
+        conn.execute(text(
+            'INSERT INTO holiday (id, date, reason, type, "group") '
+            f'SELECT id, date, reason, CASE type {cases} END, "group" FROM holiday_old '
+            'WHERE id IN (SELECT MIN(id) FROM holiday_old GROUP BY "group", date, reason)'))
+        conn.execute(text('DROP TABLE holiday_old'))
+
+
+def dedupe_holidays(engine: Engine) -> int:
+    """Removes the duplicated holidays (same group, date and reason), keeping the oldest
+    row of each, so the unique index `ux_holiday_group_date_reason` can be created.
+
+    Arguments:
+        engine (Engine): Database engine.
+
+    Returns:
+        int: Number of rows removed.
+    """
+    with engine.begin() as conn:
+        result = conn.execute(text(
+            'DELETE FROM holiday WHERE id NOT IN '
+            '(SELECT MIN(id) FROM holiday GROUP BY "group", date, reason)'))
+        return result.rowcount
+
+
+def upgrade_database(engine: Engine):
+    """Upgrades the schema of an existing database (e.g. an old `calendar.db`) in place.
+
+    Creates the missing tables and indexes, which `create_all` does not add to
+    existing tables, and rebuilds the `holiday` table if it has the old schema.
+    The duplicated holidays are removed before the unique index is created.
+
+    Arguments:
+        engine (Engine): Database engine.
+    """
+    Holiday.metadata.create_all(bind=engine)
+    if not holiday_table_is_current(engine):
+        upgrade_holiday_table(engine)
+
+    indexes = {index['name'] for index in inspect(engine).get_indexes('holiday')}
+    if 'ux_holiday_group_date_reason' not in indexes:
+        dedupe_holidays(engine)
+
+    with engine.begin() as conn:
+        for table in Holiday.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+
+def backfill_holidays(session: Session) -> List[int]:
+    """Adds the holidays missing in the years already saved, e.g. the national bridge
+    days that the databases generated before the national layer do not have (see
+    `Holidays.layers`), or the layer of a city added to the rules after the year was saved.
+
+    The number of rows of each year and group is compared with the national layer
+    (group 0) and with the delta layer of each city of the rules, so a database already
+    complete costs one query. The years saved are the years of the national layer. The
+    rows already saved are skipped by `db.insert_holidays`.
+
+    Arguments:
+        session (Session): Database session.
+
+    Returns:
+        int list: Years whose holidays were saved again.
+    """
+    year = cast(func.extract('year', Holiday.date), Integer)
+    counts = dict(((year, group), count) for year, group, count in
+                  session.query(year, Holiday.group, func.count(Holiday.id)).
+                  group_by(year, Holiday.group).all())
+    saved_years = sorted(year for year, group in counts if group == 0)
+    if not saved_years:
+        return []
+
+    rules = holiday_rules()
+    start_year, end_year = saved_years[0], saved_years[-1]
+    national = rules.national_layer(start_year, end_year)
+    layers = {0: national}
+    for city in rules.cities.values():
+        layers[city.id] = rules.city_layer(start_year, end_year, city.id, national=national)
+
+    years = set()
+    for group, layer in layers.items():
+        expected = np.bincount(layer['year'] - start_year,
+                               minlength=end_year - start_year + 1).tolist()
+        years.update(year for year in saved_years
+                     if counts.get((year, group), 0) < expected[year - start_year])
+
+    years = sorted(years)
+    for year in years:
+        db.insert_holidays(session, [{"date": holiday.date,
+                                      "reason": holiday.reason,
+                                      "type": holiday.type,
+                                      "group": group}
+                                     for group, holidays in Holidays.layers(year).items()
+                                     for holiday in holidays])
+    return years
+
+
+def init_database(engine: Engine):
+    """Prepares the database once, before the application starts serving sessions.
+
+    Creates or upgrades the schema, seeds the cities and the `Config` row and adds the
+    holidays missing in the years already saved (`backfill_holidays`), so the sessions
+    and the imports of the application do not touch the schema.
+
+    Arguments:
+        engine (Engine): Database engine.
+    """
+    upgrade_database(engine)
+    with db.session_scope() as session:
+        db.get_cities(session)
+        db.get_config(session)
+        backfill_holidays(session)
+
+
+def holidays_query_plan(session: Session,
+                        group: int = 1,
+                        has_adm_decisions: bool = True) -> List[str]:
+    """Returns the SQLite query plan of the `db.database.get_holidays` query.
+
+    Arguments:
+        session (Session): Database session.
+        group (int, optional): Group of the city. The default is 1.
+        has_adm_decisions (bool, optional): If the administrative decisions are queried.
+
+    Returns:
+        str list: Details of each step of the plan, e.g.
+            `SEARCH holiday USING INDEX ix_holiday_group_date_type (group=? AND date>? AND date<?)`.
+    """
+    query = db.holidays_query(session,
+                              group,
+                              has_adm_decisions,
+                              date(2024, 1, 1),
+                              date(2024, 2, 11))
+    statement = query.statement.compile(session.get_bind(),
+                                        compile_kwargs={"literal_binds": True})
+    rows = session.execute(text(f'EXPLAIN QUERY PLAN {statement}')).all()
+    return [row[-1] for row in rows]
+
+
+def check_query_plan(session: Session) -> bool:
+    """Checks that the `get_holidays` queries use the `(group, date, type)` index.
+
+    Arguments:
+        session (Session): Database session.
+
+    Returns:
+        bool: `True` if every `get_holidays` query searches the holiday table by the index.
+    """
+    for has_adm_decisions in [True, False]:
+        plan = holidays_query_plan(session, 1, has_adm_decisions)
+        if not any('USING INDEX ix_holiday_group_date_type' in step or
+                   'USING COVERING INDEX ix_holiday_group_date_type' in step
+                   for step in plan):
+            return False
+    return True
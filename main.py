@@ -1,12 +1,17 @@
 from utils.holidays import Holidays, CityType
+from utils.stats import stats
+import db.connection as dbconn
+import db.upgrade as upgrade
 from ui.app import *
 
 import flet as ft
 import locale
-import pandas as pd
+import os
 
 
 def test():
+    import pandas as pd
+
     for year in range(2024, 2025):
         holidays = Holidays(year, city_type=CityType.SALVADOR)
         df = pd.DataFrame(data=holidays.sorted_national)
@@ -19,5 +24,8 @@ def test():
 
 if __name__ == '__main__':
     # test()
+    upgrade.init_database(dbconn.engine)
+    if os.environ.get('LACTEC_STATS') or os.environ.get('LACTEC_TRACE'):
+        stats.enable(dbconn.engine, trace=bool(os.environ.get('LACTEC_TRACE')))
     locale.setlocale(locale.LC_ALL, 'pt_BR.UTF-8')
     ft.app(App, assets_dir="assets", port=8080, view=ft.AppView.FLET_APP_WEB)
@@ -0,0 +1,112 @@
+"""Pre-warms the holiday database.
+
+Generates the holidays of a range of years for all the cities and saves them in the
+database (`calendar.db`, or the database of `LACTEC_DB_URL`), so the application never
+has to generate a year while a user waits. The years are split in chunks, generated in
+a process pool and saved with bulk inserts. Running it again only adds what is missing.
+
+Usage:
+    python prewarm.py [--start 1900] [--end 2100] [--workers 4] [--chunk-years 25] [--store [PATH]]
+"""
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from typing import Any, List, Optional, Union, Callable
+
+import argparse
+import os
+import time
+
+from db.models import HOLIDAY_TYPES
+from utils.holiday_store import build_store, default_store_path, holidays_groups
+import db.connection as dbconn
+import db.database as db
+import db.upgrade as upgrade
+
+
+def chunk_rows(chunk: dict) -> List[dict]:
+    """Converts a chunk returned by `holidays_groups` into rows of the `holiday` table."""
+    reasons = chunk['reasons']
+    return [{"date": date.fromordinal(int(ordinal)),
+             "reason": reasons[reason],
+             "type": HOLIDAY_TYPES[type],
+             "group": int(group)}
+            for ordinal, reason, type, group in zip(chunk['ordinal'].tolist(),
+                                                    chunk['reason'].tolist(),
+                                                    chunk['type'].tolist(),
+                                                    chunk['group'].tolist())]
+
+
+def prewarm(start_year: int,
+            end_year: int,
+            workers: Optional[int] = None,
+            chunk_years: int = 25,
+            batch_size: int = 5000,
+            store_path: Optional[str] = None) -> int:
+    """Generates and saves the holidays of all the cities for a range of years.
+
+    Arguments:
+        start_year (int): First year.
+        end_year (int): Last year (inclusive).
+        workers (int, optional): Number of worker processes. The default is the number of
+            CPUs; 1 generates in the current process.
+        chunk_years (int, optional): Number of years of each chunk of work.
+        batch_size (int, optional): Maximum number of rows of each insert.
+        store_path (str, optional): If given, the holidays are also written to this
+            memory-mapped store folder (see `utils.holiday_store`).
+
+    Returns:
+        int: Number of rows sent to the database (the rows already saved are skipped).
+    """
+    upgrade.init_database(dbconn.engine)
+    with db.session_scope() as session:
+        cities = {city.id: city.has_adm_decisions
+                  for city in db.get_cities(session)}
+
+    # One chunk for the national layer and one for each city's delta layer, per years
+    chunks = []
+    for start in range(start_year, end_year + 1, chunk_years):
+        end = min(start + chunk_years - 1, end_year)
+        chunks.append((start, end, {}, True))
+        chunks += [(start, end, {city_id: has_adm}, False)
+                   for city_id, has_adm in cities.items()]
+
+    if workers == 1:
+        results = [holidays_groups(*chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(holidays_groups, *zip(*chunks)))
+
+    rows = [row for result in results for row in chunk_rows(result)]
+    with db.session_scope() as session:
+        for start in range(0, len(rows), batch_size):
+            db.insert_holidays(session, rows[start:start + batch_size])
+
+    if store_path is not None:
+        build_store(store_path, start_year, end_year, cities)
+    return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gera os feriados de todas as cidades no banco de dados.')
+    parser.add_argument('--start', type=int, default=1900, help='Primeiro ano.')
+    parser.add_argument('--end', type=int, default=2100, help='Último ano (inclusive).')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='Número de processos. 1 gera no processo atual.')
+    parser.add_argument('--chunk-years', type=int, default=25,
+                        help='Número de anos de cada parte do trabalho.')
+    parser.add_argument('--store', nargs='?', const=default_store_path, default=None,
+                        help='Também grava o armazenamento mapeado em memória '
+                             f'(pasta padrão: {default_store_path}).')
+    args = parser.parse_args()
+    if args.end < args.start:
+        parser.error('--end deve ser maior ou igual a --start')
+
+    start = time.perf_counter()
+    count = prewarm(args.start, args.end, args.workers, args.chunk_years,
+                    store_path=args.store)
+    print(f'{count} feriados de {args.start} a {args.end} gerados '
+          f'em {time.perf_counter() - start:.2f} s')
+
+
+if __name__ == '__main__':
+    main()
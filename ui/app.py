@@ -1,15 +1,12 @@
 import flet as ft
 import os
-import pdb
 from datetime import datetime
 
 from ui.calendar import Calendar
 from ui.app_bar import AppBar
-import db.connection as dbconn
+from ui.preferences import Preferences
+from utils.stats import stats, instrumented
 import db.database as db
-import db.models as models
-
-models.Base.metadata.create_all(bind=dbconn.engine)
 
 
 class App:
@@ -18,37 +15,41 @@ class App:
         self.page = page
         self.page.theme = ft.Theme(color_scheme_seed='green')
         self.page.on_resized = self.page_resize
+        self.page.on_close = self.on_close
+        stats.attach(self.page)
+        self.preferences = Preferences(self.page)
         self.page.scroll = ft.ScrollMode.AUTO
 
         self.page.title = "Calendário Lactec"
         
+        self.city_id = self.preferences.get('city_id')
         with db.session_scope() as session:
-            config = db.get_config(session)
-
-            self.city_id = config.city_id
             city = db.get_city_by_id(session, self.city_id)
+            if city is None: # city saved by the client no longer exists
+                self.preferences.reset('city_id')
+                self.city_id = self.preferences.get('city_id')
+                city = db.get_city_by_id(session, self.city_id)
             self.has_adm_decisions = city.has_adm_decisions
 
-            if config.dark_theme:
-                self.page.theme_mode = ft.ThemeMode.DARK
-            else:
-                self.page.theme_mode = ft.ThemeMode.LIGHT
+        if self.preferences.get('dark_theme'):
+            self.page.theme_mode = ft.ThemeMode.DARK
+        else:
+            self.page.theme_mode = ft.ThemeMode.LIGHT
 
-            self.page.window.width = config.window_width
-            self.page.window.height = config.window_height
-            self.page.window.top = config.window_top
-            self.page.window.left = config.window_left
+        self.page.window.width = self.preferences.get('window_width')
+        self.page.window.height = self.preferences.get('window_height')
+        self.page.window.top = self.preferences.get('window_top')
+        self.page.window.left = self.preferences.get('window_left')
 
         self.main_page()
 
 
+    @instrumented('page_resize')
     def page_resize(self, e):
-        with db.session_scope() as session:
-            db.set_page_window(session,
-                               self.page.window.width,
-                               self.page.window.height,
-                               self.page.window.top,
-                               self.page.window.left)
+        self.preferences.set(window_width=self.page.window.width,
+                             window_height=self.page.window.height,
+                             window_top=self.page.window.top,
+                             window_left=self.page.window.left)
 
 
     def theme_icon(self):
@@ -57,6 +58,7 @@ class App:
         return ft.icons.DARK_MODE
 
 
+    @instrumented('change_theme')
     def change_theme(self, e):
         if self.page.theme_mode == ft.ThemeMode.DARK:
             self.page.theme_mode = ft.ThemeMode.LIGHT
@@ -66,17 +68,18 @@ class App:
             dark_theme = True
         e.control.icon = self.theme_icon()
         self.page.update()
-        
-        with db.session_scope() as session:
-            db.set_theme(session, dark_theme)
+        self.preferences.set(dark_theme=dark_theme)
 
 
+    @instrumented('app_change_city')
     def change_city(self, city_dict: dict):
         self.city_id = city_dict['id']
         self.calendar.change_city(city_dict)
+        self.preferences.set(city_id=self.city_id)
 
-        with db.session_scope() as session:
-            db.set_city_id(session, self.city_id)
+
+    def on_close(self, e):
+        stats.end_session(self.page.session_id)
 
 
     def exit_app(self, e):
@@ -88,7 +91,8 @@ class App:
             self.change_theme,
             self.change_city,
             self.exit_app,
-            self.theme_icon)
+            self.theme_icon,
+            self.city_id)
 
         dt = datetime.now()
 
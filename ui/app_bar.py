@@ -9,7 +9,8 @@ class AppBar(ft.AppBar):
                  change_theme,
                  change_city,
                  exit_app,
-                 theme_icon):
+                 theme_icon,
+                 city_id: int):
         super().__init__()
         self.change_theme = change_theme
         self.change_city = change_city
@@ -18,9 +19,8 @@ class AppBar(ft.AppBar):
         self.bgcolor=ft.colors.SURFACE_VARIANT
 
         cities = []
+        self.city_id = city_id
         with db.session_scope() as session:
-            config = db.get_config(session)
-            self.city_id = config.city_id
             regs = db.get_cities(session)
             for reg in regs:
                 cities.append({"id": reg.id,
@@ -54,9 +54,9 @@ class AppBar(ft.AppBar):
             size=20,
             weight=ft.FontWeight.BOLD
         )
-        for i, city in enumerate(cities, 1):
+        for city in cities:
             options.append(
-                ft.dropdown.Option(key=i,
+                ft.dropdown.Option(key=city['id'],
                                    text=city['name'],
                                    alignment=ft.alignment.center,
                                    text_style=dropdown_style)
@@ -138,8 +138,9 @@ class AppBar(ft.AppBar):
 
     def on_change_city(self, e: ft.ControlEvent):
         control: ft.Dropdown = e.control
-        idx = int(control.value) - 1
-        self.change_city(self.cities[idx])
+        city_id = int(control.value)
+        city = next(city for city in self.cities if city['id'] == city_id)
+        self.change_city(city)
 
 
     def on_about(self, e: ft.ControlEvent):
@@ -1,15 +1,26 @@
 import flet as ft
-import pdb
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime, timedelta
-from pprintpp import pprint
 from sqlalchemy.orm import Session
-from typing import Any, List, Optional, Union, Callable
+from typing import Any, List, Optional, Tuple, Union, Callable
 
 from db.models import *
 from utils import utils
+from utils.business_days import business_calendar
+from utils.holiday_store import default_store
 from utils.holidays import Holidays, CityType, months, weeks
+from utils.stats import instrumented, traced
+from ui.day_cell import DayCell
 import db.database as db
 
+prefetch_executor = ThreadPoolExecutor(max_workers=4,
+                                       thread_name_prefix='calendar-prefetch')
+"""Thread pool shared by all sessions to prefetch the neighbouring months."""
+
+generation_lock = threading.Lock()
+"""Serializes the generation of the holidays of a year."""
+
 
 class Calendar(ft.Container):
     def __init__(self,
@@ -17,7 +28,8 @@ class Calendar(ft.Container):
                  month: int,
                  city_id: int,
                  has_adm_decisions: bool,
-                 max_delta_years: int = 10):
+                 max_delta_years: int = 10,
+                 max_cached_months: int = 48):
         super().__init__()
         self.year = year
         self.month = month
@@ -25,24 +37,26 @@ class Calendar(ft.Container):
         self.has_adm_decisions = has_adm_decisions
         dt = datetime.now()
         self.this_year = dt.year
-        self.last_year = -1
-        self.last_city_id = -1
+        self.saved_years = set()
+        """Years whose holidays are known to be saved on the database."""
         self.max_delta_years = max_delta_years
         self.min_year = self.this_year - max_delta_years
         self.max_year = self.this_year + max_delta_years
-
-        self.bs = ft.BottomSheet(
-            content=ft.Container(
-                content=ft.Row(
-                    controls=[
-                        ft.ProgressRing(color=ft.colors.ORANGE),
-                        ft.Text("Carregando dados...")
-                    ],
-                    alignment=ft.MainAxisAlignment.CENTER
-                ),
-                height=150
-            )
-        )
+        self.grid_items = 42
+        self.grid_cache = utils.LRUCache(maxsize=max_cached_months)
+        """Holidays of the months already shown, by (year, month, city_id, has_adm_decisions)."""
+        self.prefetch_futures = []
+        self.prefetch_generation = 0
+        """Incremented to discard the prefetches of a previous city."""
+
+        self.progress = ft.ProgressRing(width=20,
+                                        height=20,
+                                        color=ft.colors.ORANGE,
+                                        tooltip="Gerando feriados...",
+                                        visible=False)
+        self.generating_years = set()
+        """Years being generated on the background for this session."""
+        self.render_lock = threading.RLock()
         
         self.nav_style = ft.TextStyle(
             size=20,
@@ -62,6 +76,7 @@ class Calendar(ft.Container):
                     tooltip="Mês anterior"
                 ),
                 self.year_month,
+                self.business_days,
                 ft.IconButton(
                     ft.icons.KEYBOARD_ARROW_RIGHT,
                     on_click=self.on_next_month,
@@ -72,6 +87,7 @@ class Calendar(ft.Container):
                     on_click=self.on_next_year,
                     tooltip="Próximo ano"
                 ),
+                self.progress,
             ],
             alignment=ft.MainAxisAlignment.CENTER
         )
@@ -102,7 +118,11 @@ class Calendar(ft.Container):
             child_aspect_ratio=4.0,
         )
 
+        self.cells = [DayCell() for _ in range(self.grid_items)]
+        """Cells of the grid, created once and updated in place."""
+        self.rendered = False
         self.gridview = ft.GridView(
+            controls=self.cells,
             expand=True,
             runs_count=7,
             padding=2,
@@ -132,87 +152,288 @@ class Calendar(ft.Container):
 
 
     def update_year_month(self, refresh: bool = False):
-        self.year_month = ft.Text(
-                f'{self.year} - {months[self.month - 1]}',
-                style=self.nav_style,
-                width=170)
+        year_month = f'{self.year} - {months[self.month - 1]}'
+        business_days = f'{self.business_days_in_month()} dias úteis'
         if refresh:
-            self.content.controls[0].controls[2] = self.year_month
-
-
+            self.year_month.value = year_month
+            self.business_days.value = business_days
+        else:
+            self.year_month = ft.Text(
+                    year_month,
+                    style=self.nav_style,
+                    width=170)
+            self.business_days = ft.Text(
+                    business_days,
+                    width=110)
+
+
+    def business_days_in_month(self) -> int:
+        """Returns the number of business days of the current month in the city.
+        """
+        calendar = business_calendar(self.city_id, self.has_adm_decisions)
+        return calendar.business_days_in_month(self.year, self.month)
+
+
+    def grid_dates(self, year: int, month: int) -> Tuple[date, date]:
+        """Returns the first and last dates of the 42 days shown for the month.
+
+        Arguments:
+            year (int): Year of the month.
+            month (int): The month.
+        """
+        dt = date(year, month, 1)
+        wd = dt.weekday()
+        if wd < 6:
+            start_date = dt - timedelta(days=wd + 1)
+        else:
+            start_date = dt
+        end_date = start_date + timedelta(days=self.grid_items - 1)
+        return start_date, end_date
+
+
+    def grid_years(self, year: int, month: int) -> List[int]:
+        """Returns the years of the 42 days shown for the month.
+
+        Arguments:
+            year (int): Year of the month.
+            month (int): The month.
+        """
+        start_date, end_date = self.grid_dates(year, month)
+        return list(range(start_date.year, end_date.year + 1))
+
+
+    def month_holidays(self,
+                       session: Session,
+                       year: int,
+                       month: int,
+                       city_id: int,
+                       has_adm_decisions: bool) -> Optional[List[dict]]:
+        """Queries the holidays of the 42 days shown for the month.
+
+        Arguments:
+            session (Session): Database session.
+            year (int): Year of the month.
+            month (int): The month.
+            city_id (int): Id of the city, which is also its holidays group.
+            has_adm_decisions (bool): If the city has administrative decisions.
+
+        Returns:
+            dict list: Holidays (date, reason and type), or `None` if the query failed.
+        """
+        start_date, end_date = self.grid_dates(year, month)
+        holidays = db.get_holidays(session,
+                                   city_id,
+                                   has_adm_decisions,
+                                   start_date,
+                                   end_date)
+        if holidays is None:
+            return None
+
+        holidays_list = []
+        for holiday in holidays:
+            data_dict = {"date": holiday.date,
+                         "reason": holiday.reason,
+                         "type": holiday.type}
+            holidays_list.append(data_dict)
+        return holidays_list
+
+
+    def store_holidays(self,
+                       year: int,
+                       month: int,
+                       city_id: int,
+                       has_adm_decisions: bool) -> Optional[List[dict]]:
+        """Reads the holidays of the 42 days shown for the month from the memory-mapped
+        holiday store (see `prewarm.py --store`), without querying the database.
+
+        Arguments:
+            year (int): Year of the month.
+            month (int): The month.
+            city_id (int): Id of the city, which is also its holidays group.
+            has_adm_decisions (bool): If the city has administrative decisions.
+
+        Returns:
+            dict list: Holidays (date, reason and type), or `None` if there is no store or
+                it does not have the city or the years shown.
+        """
+        store = default_store()
+        if store is None or not store.has_group(city_id):
+            return None
+        start_date, end_date = self.grid_dates(year, month)
+        if not store.covers(start_date, end_date):
+            return None
+        return store.get_holidays(city_id, has_adm_decisions, start_date, end_date)
+
+
+    @instrumented('update_content')
     def update_content(self):
-        with db.session_scope() as session:
-            dt = datetime(self.year, self.month, 1)
-            sd = dt
-            wd = dt.weekday()
-            items = 42
-            if wd < 6:
-                days = wd + 1
-                start_date = dt - timedelta(days=days)
-            else:
-                start_date = dt
-            
-            end_date = start_date + timedelta(days=items - 1)
-
-            if self.last_year != self.year or self.last_city_id != self.city_id:
-                self.last_year = self.year
-                self.last_city_id = self.city_id
-
-                new_year = db.get_first_year_holiday(session, self.year)
-                if not new_year:
-                    self.save_holidays_db(session)
-
-            holidays = db.get_holidays(session,
-                                       self.city_id,
-                                       self.has_adm_decisions,
-                                       start_date.date(),
-                                       end_date.date())
-            holidays_list = []
-            for holiday in holidays:
-                data_dict = {"date": holiday.date,
-                             "reason": holiday.reason,
-                             "type": holiday.type}
-                holidays_list.append(data_dict)
-            
-            containers = []
-            today_date = datetime.now().date()
-            if wd < 6:
-                days = wd + 1
-                sd = dt - timedelta(days=days)
-                for i in range(days):
-                    date = sd.date()
-                    is_today = date == today_date
-                    container = self.day_container(date, holidays_list, is_today)
-                    containers.append(container)
-                    items -= 1
-                    sd += timedelta(days=1)
-            while items > 0:
-                date = sd.date()
-                is_today = date == today_date
-                container = self.day_container(date, holidays_list, is_today)
-                containers.append(container)
-                items -= 1
-                sd += timedelta(days=1)
-
-            self.update_year_month(True)
-            self.gridview.controls = containers
+        with self.render_lock:
+            self.render_content()
+
+
+    def render_content(self):
+        key = (self.year, self.month, self.city_id, self.has_adm_decisions)
+        holidays_list = self.grid_cache.get(key)
+        if holidays_list is None:
+            holidays_list = self.store_holidays(*key)
+            if holidays_list is not None:
+                self.grid_cache.put(key, holidays_list)
+        if holidays_list is None:
+            missing_years = []
+            with db.session_scope() as session:
+                for year in self.grid_years(self.year, self.month):
+                    if year in self.saved_years:
+                        continue
+
+                    new_year = db.get_first_year_holiday(session, year)
+                    if new_year:
+                        self.saved_years.add(year)
+                    else:
+                        missing_years.append(year)
+
+                holidays_list = self.month_holidays(session,
+                                                    self.year,
+                                                    self.month,
+                                                    self.city_id,
+                                                    self.has_adm_decisions)
+            if missing_years:
+                # Shows the data already saved and patches the grid when the
+                # generation finishes.
+                self.generate_holidays_background(missing_years)
+            elif holidays_list is not None:
+                self.grid_cache.put(key, holidays_list)
+            if holidays_list is None:
+                holidays_list = []
+
+        holidays_by_date = {}
+        for holiday in holidays_list:
+            holidays_by_date.setdefault(holiday['date'], []).append(holiday)
+
+        changed = []
+        today_date = datetime.now().date()
+        start_date, _ = self.grid_dates(self.year, self.month)
+        for i, cell in enumerate(self.cells):
+            date = start_date + timedelta(days=i)
+            is_today = date == today_date
+            state = self.day_state(date, holidays_by_date.get(date, []), is_today)
+            if cell.set_state(state):
+                changed.append(cell)
+
+        self.update_year_month(True)
+        if self.rendered:
+            # Sends only the controls that changed, not the whole calendar.
+            self.page.update(self.year_month,
+                             self.business_days,
+                             self.progress,
+                             *changed)
+        else:
             self.update()
-
-
-    def day_container(self,
-                      date: date,
-                      holidays_list: List[dict],
-                      is_today: bool) -> ft.Container:
+            self.rendered = True
+        self.prefetch_neighbours()
+
+
+    def shift_month(self, year: int, month: int, months: int) -> Optional[Tuple[int, int]]:
+        """Returns the year and month shifted by a number of months.
+
+        Arguments:
+            year (int): The year.
+            month (int): The month.
+            months (int): Months to shift: can be a negative or positive value.
+
+        Returns:
+            tuple: (year, month), or `None` if out of the years shown by the calendar.
+        """
+        index = year * 12 + month - 1 + months
+        year, month = index // 12, index % 12 + 1
+        if year < self.min_year or year > self.max_year:
+            return None
+        return year, month
+
+
+    def prefetch_neighbours(self):
+        """Loads the targets of the navigation buttons (previous and next months and years)
+        on the background thread pool, so the next click finds them in the cache.
+        """
+        self.prefetch_futures = [future for future in self.prefetch_futures
+                                 if not future.done()]
+        for months in [1, -1, 12, -12]:
+            target = self.shift_month(self.year, self.month, months)
+            if target is None:
+                continue
+            key = target + (self.city_id, self.has_adm_decisions)
+            if key in self.grid_cache:
+                continue
+            future = prefetch_executor.submit(self.prefetch_month,
+                                              self.prefetch_generation,
+                                              key)
+            self.prefetch_futures.append(future)
+
+
+    def prefetch_month(self, generation: int, key: tuple):
+        """Generates (if needed) and caches the holidays of a month, on a worker thread.
+
+        Arguments:
+            generation (int): Value of `prefetch_generation` when the prefetch was requested.
+            key (tuple): (year, month, city_id, has_adm_decisions) of the month.
+        """
+        year, month, city_id, has_adm_decisions = key
+        if generation != self.prefetch_generation or key in self.grid_cache:
+            return
+
+        try:
+            holidays_list = self.store_holidays(*key)
+            if holidays_list is not None:
+                self.grid_cache.put(key, holidays_list)
+                return
+
+            with db.session_scope() as session:
+                for grid_year in self.grid_years(year, month):
+                    if grid_year not in self.saved_years:
+                        self.generate_year_holidays(session, grid_year)
+                        self.saved_years.add(grid_year)
+                if generation != self.prefetch_generation:
+                    return
+                holidays_list = self.month_holidays(session,
+                                                    year,
+                                                    month,
+                                                    city_id,
+                                                    has_adm_decisions)
+            if holidays_list is not None and generation == self.prefetch_generation:
+                self.grid_cache.put(key, holidays_list)
+
+        except Exception as e:
+            db.save_log_message(None, LogType.ERROR, e)
+
+
+    def cancel_prefetch(self):
+        """Cancels the pending prefetches and discards the results of the running ones.
+        """
+        self.prefetch_generation += 1
+        for future in self.prefetch_futures:
+            future.cancel()
+        self.prefetch_futures = []
+
+
+    def day_state(self,
+                  date: date,
+                  items: List[dict],
+                  is_today: bool) -> Tuple:
+        """Returns what the cell of a day shows.
+
+        Arguments:
+            date (date): The day.
+            items (dict list): Holidays of the day.
+            is_today (bool): `True` if the day is today.
+
+        Returns:
+            tuple: State of the `DayCell`: (day, text color, background color, is the
+                month shown, holiday reason or `None`, tooltip or `None`).
+        """
         month = date.month
         weekday = date.weekday()
-        items = utils.search_by_key(holidays_list, "date", date)
         is_holiday = len(items) > 0
         tooltip = items[0]['type'].value if is_holiday else None
-
-        reason_style = ft.TextStyle(
-            size=20,
-            italic=True
-        )
+        reason = items[0]['reason'] if is_holiday else None
 
         if is_today:
             text_color = ft.colors.BLACK
@@ -234,138 +455,191 @@ class Calendar(ft.Container):
                     if month == self.month \
                     else ft.colors.GREY_100
 
-        if month == self.month:
-            day_style = ft.TextStyle(
-                size=20,
-                weight=ft.FontWeight.BOLD
-            )
-        else:
-            day_style = ft.TextStyle(
-                size=20,
-                weight=ft.FontWeight.NORMAL
-            )
-        
-        if is_holiday:
-            controls=[
-                    ft.Text(date.day,
-                            color=text_color,
-                            style=day_style),
-                    ft.Text(items[0]['reason'],
-                            color=text_color,
-                            style=reason_style)
-            ]
-        else:
-            controls=[
-                    ft.Text(date.day,
-                            color=text_color,
-                            style=day_style)
-            ]
-        
-        container = ft.Container(
-            content=ft.Column(controls=controls),
-            bgcolor=bgcolor,
-            border_radius=10,
-            padding=ft.padding.all(10),
-            border=ft.border.all(1, 'black'),
-            tooltip=tooltip
-        )
-        return container
+        return (date.day, text_color, bgcolor, month == self.month, reason, tooltip)
 
-    
-    def save_holidays_db(self, session: Session):
-        self.page.open(self.bs)
-        
-        curitiba_holidays = Holidays(self.year, CityType.CURITIBA)
-        salvador_holidays = Holidays(self.year, CityType.SALVADOR)
-        navegantes_holidays = Holidays(self.year, CityType.NAVEGANTES, False)
-        national_holidays_dict = curitiba_holidays.sorted_national
-        curitiba_holidays_dict = curitiba_holidays.sorted_local
-        salvador_holidays_dict = salvador_holidays.sorted_local
-        navegantes_holidays_dict = navegantes_holidays.sorted_local
-        
-        self.save_holidays_dict_db(session,
-                                   national_holidays_dict,
-                                   0)
-        
-        if len(curitiba_holidays_dict) > 0:
-            self.save_holidays_dict_db(session,
-                                       curitiba_holidays_dict,
-                                       1)
-        
-        if len(salvador_holidays_dict) > 0:
-            self.save_holidays_dict_db(session,
-                                       salvador_holidays_dict,
-                                       2)
-            
-        if len(navegantes_holidays_dict) > 0:
-            self.save_holidays_dict_db(session,
-                                       navegantes_holidays_dict,
-                                       3)
 
-        self.page.close(self.bs)
+    def day_container(self,
+                      date: date,
+                      holidays_list: List[dict],
+                      is_today: bool,
+                      cell: Optional[DayCell] = None) -> DayCell:
+        """Shows a day in a cell of the grid.
+
+        Arguments:
+            date (date): The day.
+            holidays_list (dict list): Holidays of the days shown.
+            is_today (bool): `True` if the day is today.
+            cell (:obj:`DayCell`, optional): Cell to update. The default creates a new one.
+
+        Returns:
+            DayCell: The cell.
+        """
+        items = utils.search_by_key(holidays_list, "date", date)
+        if cell is None:
+            cell = DayCell()
+        cell.set_state(self.day_state(date, items, is_today))
+        return cell
+
+    
+    def generate_holidays_background(self, years: List[int]):
+        """Generates the holidays of the years on a worker thread, without blocking the
+        event handler, and renders the month again when they are saved.
+
+        Arguments:
+            years (int list): Years missing on the database.
+        """
+        years = [year for year in years if year not in self.generating_years]
+        if not years:
+            return
+
+        self.generating_years.update(years)
+        self.progress.visible = True
+        prefetch_executor.submit(self.generate_holidays_task, years)
+
+
+    def generate_holidays_task(self, years: List[int]):
+        """Worker of `generate_holidays_background`.
+
+        Arguments:
+            years (int list): Years to generate.
+        """
+        try:
+            with db.session_scope() as session:
+                for year in years:
+                    self.generate_year_holidays(session, year)
+                    self.saved_years.add(year)
+
+        except Exception as e:
+            db.save_log_message(None, LogType.ERROR, e)
+
+        finally:
+            self.generating_years.difference_update(years)
+
+        # Shows the new holidays and hides the progress ring, even if the generation failed
+        try:
+            with self.render_lock:
+                self.progress.visible = len(self.generating_years) > 0
+                if set(years) & set(self.grid_years(self.year, self.month)):
+                    self.render_content()
+                else:
+                    self.progress.update()
+
+        except Exception as e:
+            db.save_log_message(None, LogType.ERROR, e)
+
+
+    def generate_year_holidays(self, session: Session, year: int) -> bool:
+        """Generates and saves the holidays of all the cities for the year, if not saved yet.
+
+        Arguments:
+            session (Session): Database session.
+            year (int): The year.
+
+        Returns:
+            bool: `True` if the holidays were generated.
+        """
+        with generation_lock:
+            if db.get_first_year_holiday(session, year):
+                return False
+
+            self.save_holidays_db(session, year)
+            self.invalidate_year(year)
+        return True
+
+
+    def invalidate_year(self, year: int):
+        """Removes the cached months whose 42 days include the year.
+
+        Arguments:
+            year (int): The year whose holidays changed.
+        """
+        def overlaps(key: tuple) -> bool:
+            start_date, end_date = self.grid_dates(key[0], key[1])
+            return start_date.year <= year <= end_date.year
+
+        self.grid_cache.evict(overlaps)
+
+
+    @traced('save_holidays_db')
+    def save_holidays_db(self, session: Session, year: int):
+        """Saves the holidays of the year: the national layer in the group 0 and the delta
+        layer (local holidays and their bridge days) of each city of the holiday rules in
+        the group of its id. See `Holidays.layers`.
+
+        All the groups are saved in a single insert and commit, so other sessions never
+        see the national holidays of the year without the local ones.
+
+        Arguments:
+            session (Session): Database session.
+            year (int): The year.
+        """
+        rows = []
+        for group, holidays in Holidays.layers(year).items():
+            rows += self.holiday_rows(holidays, group)
+        db.insert_holidays(session, rows)
+
+
+    def holiday_rows(self,
+                     holidays_dict: List[dict],
+                     group: int) -> List[dict]:
+        """Converts holidays into rows of the `holiday` table.
+
+        Arguments:
+            holidays_dict (dict list): Holidays (date, reason and type).
+            group (int): Group of the holidays.
+
+        Returns:
+            dict list: Rows with the keys `date`, `reason`, `type` and `group`.
+        """
+        rows = []
+        for dict in holidays_dict:
+            rows.append({
+                "date": dict['date'],
+                "reason": dict['reason'],
+                "type": dict['type'],
+                "group": group
+            })
+        return rows
 
 
     def save_holidays_dict_db(self, session: Session,
                               holidays_dict: List[dict],
                               group: int):
-        db_holidays = []
-        for dict in holidays_dict:
-            date = dict['date']
-            year_month = f'{date:%Y%m}'
-            reason = dict['reason']
-            type = dict['type']
-            holiday = Holiday(
-                date=date,
-                year_month=year_month,
-                reason=reason,
-                type=type,
-                group=group
-            )
-            db_holidays.append(holiday)
-        
-        if len(db_holidays) > 0:
-            db.save_objects(session, db_holidays)
+        rows = self.holiday_rows(holidays_dict, group)
+        if len(rows) > 0:
+            db.insert_holidays(session, rows)
 
 
     def on_next_month(self, e: ft.ControlEvent):
-        year = self.year
-        month = self.month + 1
-        if month > 12 and year < self.max_year:
-            month = 1
-            year += 1
-        if year <= self.max_year:
-            self.month = month
-            self.year = year
-            self.update_content()
+        self.go_to(self.shift_month(self.year, self.month, 1))
 
 
     def on_previous_month(self, e: ft.ControlEvent):
-        year = self.year
-        month = self.month - 1
-        if month < 1:
-            month = 12
-            year -= 1
-        if year >= self.min_year:
-            self.month = month
-            self.year = year
-            self.update_content()
+        self.go_to(self.shift_month(self.year, self.month, -1))
 
 
     def on_next_year(self, e: ft.ControlEvent):
-        year = self.year + 1
-        if year <= self.max_year:
-            self.year = year
-            self.update_content()
+        self.go_to(self.shift_month(self.year, self.month, 12))
 
 
     def on_previous_year(self, e: ft.ControlEvent):
-        year = self.year - 1
-        if year >= self.min_year:
-            self.year = year
+        self.go_to(self.shift_month(self.year, self.month, -12))
+
+
+    def go_to(self, target: Optional[Tuple[int, int]]):
+        """Shows the month, if it is in the years shown by the calendar.
+
+        Arguments:
+            target (tuple): (year, month) returned by `shift_month`, or `None`.
+        """
+        if target is not None:
+            self.year, self.month = target
             self.update_content()
 
 
+    @instrumented('change_city')
     def change_city(self, city_dict: dict):
+        self.cancel_prefetch()
         self.city_id = city_dict['id']
         self.has_adm_decisions = city_dict['has_adm_decisions']
         self.update_content()
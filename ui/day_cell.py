@@ -0,0 +1,69 @@
+import flet as ft
+from typing import Any, List, Optional, Tuple, Union, Callable
+
+
+DAY_STYLE = ft.TextStyle(
+    size=20,
+    weight=ft.FontWeight.BOLD
+)
+"""Style of the days of the month shown."""
+
+OTHER_MONTH_DAY_STYLE = ft.TextStyle(
+    size=20,
+    weight=ft.FontWeight.NORMAL
+)
+"""Style of the days of the previous and next months."""
+
+REASON_STYLE = ft.TextStyle(
+    size=20,
+    italic=True
+)
+
+CELL_BORDER = ft.border.all(1, 'black')
+CELL_PADDING = ft.padding.all(10)
+
+
+class DayCell(ft.Container):
+    """Cell of a day in the calendar grid.
+
+    The cells are created once and reused: `set_state` only changes the properties that
+    differ from the day shown before, and the styles are shared by all the cells.
+    """
+    def __init__(self):
+        super().__init__()
+        self.day_text = ft.Text()
+        self.reason_text = ft.Text(style=REASON_STYLE,
+                                   visible=False)
+        self.content = ft.Column(controls=[self.day_text,
+                                           self.reason_text])
+        self.border_radius = 10
+        self.padding = CELL_PADDING
+        self.border = CELL_BORDER
+        self.shown_state = None
+
+
+    def set_state(self, state: Tuple) -> bool:
+        """Shows a day in the cell.
+
+        Arguments:
+            state (tuple): (day, text color, background color, is the month shown,
+                holiday reason or `None`, tooltip or `None`), as returned by
+                `Calendar.day_state`.
+
+        Returns:
+            bool: `True` if the cell changed and must be updated.
+        """
+        if state == self.shown_state:
+            return False
+
+        day, text_color, bgcolor, is_month, reason, tooltip = state
+        self.day_text.value = day
+        self.day_text.color = text_color
+        self.day_text.style = DAY_STYLE if is_month else OTHER_MONTH_DAY_STYLE
+        self.reason_text.value = reason
+        self.reason_text.color = text_color
+        self.reason_text.visible = reason is not None
+        self.bgcolor = bgcolor
+        self.tooltip = tooltip
+        self.shown_state = state
+        return True
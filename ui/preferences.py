@@ -0,0 +1,100 @@
+import flet as ft
+from typing import Any, List, Optional, Union, Callable
+
+import threading
+
+from db.config_service import config_service, ConfigService
+from db.models import LogType
+import db.database as db
+
+
+class Preferences:
+    """Preferences of a session (theme, city and window) kept in the client storage of the
+    browser, so concurrent users do not share nor write the single `Config` row.
+
+    The values missing on the client fall back to the `Config` row, which is only read.
+    The theme and the city change rarely and are written to the client storage at once,
+    while the session is connected. The window size and position change on every resize
+    event and are written `delay` seconds after the last change.
+
+    Arguments:
+        page (Page): Page of the session.
+        delay (float, optional): Seconds without window changes before the write. The
+            default is 1.
+    """
+    key = 'lactec_calendar.preferences'
+    """Key of the preferences in the client storage."""
+    debounced = ('window_width', 'window_height', 'window_top', 'window_left')
+    """Preferences written `delay` seconds after the last change."""
+
+    def __init__(self, page: ft.Page, delay: float = 1.0):
+        self.page = page
+        self.delay = delay
+        self.timer = None
+        self.lock = threading.RLock()
+
+        stored = None
+        try:
+            stored = page.client_storage.get(self.key)
+        except Exception as e:
+            db.save_log_message(None, LogType.ERROR, e)
+        if not isinstance(stored, dict):
+            stored = {}
+
+        self.values = {}
+        for field in ConfigService.fields:
+            value = stored.get(field)
+            self.values[field] = value if value is not None else config_service.get(field)
+
+
+    def get(self, name: str) -> Any:
+        """Returns a preference of the session.
+
+        Arguments:
+            name (str): Name of the `Config` column.
+        """
+        return self.values[name]
+
+
+    def set(self, **values):
+        """Changes preferences of the session and writes them to the client, at once or,
+        if only the window changed, after `delay` seconds.
+
+        Arguments:
+            **values: New values by `Config` column name.
+        """
+        with self.lock:
+            changes = {name: value for name, value in values.items()
+                       if self.values[name] != value}
+            if not changes:
+                return
+            self.values.update(changes)
+            if any(name not in self.debounced for name in changes):
+                self.write()
+                return
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer = threading.Timer(self.delay, self.write)
+            self.timer.daemon = True
+            self.timer.start()
+
+
+    def reset(self, name: str):
+        """Returns a preference to the default of the `Config` row.
+
+        Arguments:
+            name (str): Name of the `Config` column.
+        """
+        self.set(**{name: config_service.get(name)})
+
+
+    def write(self):
+        """Writes the preferences to the client storage, with the pending window changes."""
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            try:
+                self.page.client_storage.set(self.key, dict(self.values))
+            except Exception as e:
+                db.save_log_message(None, LogType.ERROR, e)
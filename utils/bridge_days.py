@@ -0,0 +1,76 @@
+from typing import Any, List, Optional, Sequence, Tuple, Union, Callable
+
+TUESDAY = 1
+THURSDAY = 3
+
+
+def resolve_bridge_days(ordinals: Sequence[int],
+                        eligible: Sequence[bool],
+                        years: Optional[Sequence[int]] = None,
+                        taken: Sequence[int] = (),
+                        taken_years: Optional[Sequence[int]] = None) -> List[Tuple[int, int]]:
+    """Decides the bridge days ("dia ponte") of a sorted list of holidays in one linear sweep.
+
+    A holiday on a tuesday bridges the monday before it, and a holiday on a thursday
+    bridges the friday after it, unless that day is already a holiday of the same year.
+    A monday can only be claimed by the holidays of the tuesday after it and a friday
+    by the holidays of the thursday before it, so the holidays of different dates never
+    claim the same day and checking a bridge day only looks at the holidays next to it.
+    When many holidays of the same date can bridge, the first one in the list wins.
+
+    Arguments:
+        ordinals (int sequence): Date ordinals of the holidays, sorted. The holidays of the
+            same date are in insertion order.
+        eligible (bool sequence): If each holiday can generate a bridge day.
+        years (int sequence, optional): Year of each holiday. A holiday of another year
+            does not block a bridge day. The default is a single year.
+        taken (int sequence, optional): Sorted date ordinals of other holidays, which
+            block the bridge days but do not generate them (e.g. the national layer).
+        taken_years (int sequence, optional): Year of each holiday of `taken`. Required
+            with `years`.
+
+    Returns:
+        tuple list: (index of the holiday, ordinal of its bridge day), sorted by date.
+    """
+    size = len(ordinals)
+    if years is None:
+        years = [0] * size
+        taken_years = [0] * len(taken)
+
+    bridges = []
+    t = 0 # position of the sweep in `taken`
+    i = 0
+    while i < size:
+        ordinal = ordinals[i]
+        j = i # the holidays of the date are [i, j)
+        while j < size and ordinals[j] == ordinal:
+            j += 1
+        while t < len(taken) and taken[t] < ordinal - 1:
+            t += 1
+
+        weekday = (ordinal + 6) % 7
+        first = next((k for k in range(i, j) if eligible[k]), None)
+        if first is not None and weekday in (TUESDAY, THURSDAY):
+            year = years[first]
+            if weekday == TUESDAY:
+                candidate = ordinal - 1
+                before = range(i - 1, -1, -1)
+            else:
+                candidate = ordinal + 1
+                before = range(j, size)
+
+            is_free = True
+            for k in before: # holidays of the list next to the date
+                if ordinals[k] != candidate:
+                    break
+                if years[k] == year:
+                    is_free = False
+            for k in range(t, len(taken)): # other holidays around the date
+                if taken[k] > candidate:
+                    break
+                if taken[k] == candidate and taken_years[k] == year:
+                    is_free = False
+            if is_free:
+                bridges.append((first, candidate))
+        i = j
+    return bridges
@@ -0,0 +1,174 @@
+from datetime import date
+from functools import lru_cache
+from typing import Any, List, Optional, Union, Callable
+import numpy as np
+
+from db.models import HolidayType
+from utils.holidays import CityType, holidays_columns
+
+
+class BusinessCalendar:
+    """Business-day arithmetic of a city, backed by a precomputed bitmap of the days.
+
+    A day is not a business day when it is a saturday, a sunday or a holiday of the city
+    (national or local). As in `db.database.get_holidays`, the administrative decisions
+    are only holidays when the city has them. Every query is O(1).
+
+    Arguments:
+        city_type (:obj:`CityType` or int): The city, or its id in the holiday rules.
+        has_adm_decisions (bool): If the administrative decisions are days off.
+        start_year (int): First year covered by the calendar.
+        end_year (int): Last year covered by the calendar (inclusive).
+    """
+    def __init__(self,
+                 city_type: Union[CityType, int],
+                 has_adm_decisions: bool = True,
+                 start_year: int = 1900,
+                 end_year: int = 2200):
+        self.city_type = city_type
+        self.has_adm_decisions = has_adm_decisions
+        self.first_ordinal = date(start_year, 1, 1).toordinal()
+        self.last_ordinal = date(end_year, 12, 31).toordinal()
+
+        columns = holidays_columns(start_year, end_year, [city_type], has_adm_decisions)
+        ordinals = columns['ordinal']
+        if not has_adm_decisions:
+            ordinals = ordinals[columns['type'] != HolidayType.ADMINISTRATIVE_DECISION.code]
+        ordinals = ordinals[(ordinals >= self.first_ordinal) & (ordinals <= self.last_ordinal)]
+
+        days = np.arange(self.first_ordinal, self.last_ordinal + 1, dtype=np.int64)
+        business = (days + 6) % 7 < 5 # monday to friday
+        business[ordinals - self.first_ordinal] = False
+        self.business = business
+        """Bitmap of the business days, indexed by ordinal - `first_ordinal`."""
+        self.cumulative = np.concatenate(([0], np.cumsum(business)))
+        """Number of business days before each index of `business`."""
+        self.business_ordinals = days[business]
+        """Ordinals of the business days, in order."""
+
+
+    def index(self, day: date) -> int:
+        """Returns the index of the day in the bitmap.
+
+        Arguments:
+            day (date): The day.
+
+        Returns:
+            int: Index of the day.
+        """
+        ordinal = day.toordinal()
+        if ordinal < self.first_ordinal or ordinal > self.last_ordinal:
+            raise ValueError(f'{day} is out of the range of the business calendar')
+        return ordinal - self.first_ordinal
+
+
+    def is_business_day(self, day: date) -> bool:
+        """Returns `True` if the day is a business day.
+
+        Arguments:
+            day (date): The day.
+        """
+        return bool(self.business[self.index(day)])
+
+
+    def add_business_days(self, day: date, days: int) -> date:
+        """Adds business days to a date.
+
+        Arguments:
+            day (date): Start date, which does not need to be a business day.
+            days (int): Business days to add: can be a negative or positive value.
+
+        Returns:
+            date: The `days`-th business day after (or before, if negative) the date.
+                With zero days, the date itself.
+        """
+        if days == 0:
+            return day
+
+        index = self.index(day)
+        if days > 0:
+            position = int(self.cumulative[index + 1]) + days - 1
+        else:
+            position = int(self.cumulative[index]) + days
+        if position < 0 or position >= len(self.business_ordinals):
+            raise ValueError(f'{days} business days from {day} is out of the range of the business calendar')
+        return date.fromordinal(int(self.business_ordinals[position]))
+
+
+    def business_days_between(self, start_date: date, end_date: date) -> int:
+        """Counts the business days between two dates.
+
+        Arguments:
+            start_date (date): First date (inclusive).
+            end_date (date): Last date (exclusive).
+
+        Returns:
+            int: Number of business days. Negative when `end_date` is before `start_date`.
+        """
+        start = self.index(start_date)
+        end = self.index(end_date)
+        return int(self.cumulative[end] - self.cumulative[start])
+
+
+    def business_days_in_month(self, year: int, month: int) -> int:
+        """Counts the business days of a month.
+
+        Arguments:
+            year (int): Year of the month.
+            month (int): The month.
+
+        Returns:
+            int: Number of business days.
+        """
+        start = self.index(date(year, month, 1))
+        if month == 12:
+            end = date(year + 1, 1, 1).toordinal() - self.first_ordinal
+        else:
+            end = self.index(date(year, month + 1, 1))
+        return int(self.cumulative[end] - self.cumulative[start])
+
+
+@lru_cache(maxsize=None)
+def business_calendar(city_type: Union[CityType, int],
+                      has_adm_decisions: bool = True) -> BusinessCalendar:
+    """Returns the shared business calendar of the city.
+
+    Arguments:
+        city_type (:obj:`CityType` or int): The city, or its id in the holiday rules.
+        has_adm_decisions (bool, optional): If the administrative decisions are days off.
+
+    Returns:
+        BusinessCalendar: The business calendar, built on the first call.
+    """
+    return BusinessCalendar(city_type, has_adm_decisions)
+
+
+def is_business_day(day: date,
+                    city_type: CityType = CityType.CURITIBA,
+                    has_adm_decisions: bool = True) -> bool:
+    """Returns `True` if the day is a business day in the city. See `BusinessCalendar`."""
+    return business_calendar(city_type, has_adm_decisions).is_business_day(day)
+
+
+def add_business_days(day: date,
+                      days: int,
+                      city_type: CityType = CityType.CURITIBA,
+                      has_adm_decisions: bool = True) -> date:
+    """Adds business days of the city to a date. See `BusinessCalendar`."""
+    return business_calendar(city_type, has_adm_decisions).add_business_days(day, days)
+
+
+def business_days_between(start_date: date,
+                          end_date: date,
+                          city_type: CityType = CityType.CURITIBA,
+                          has_adm_decisions: bool = True) -> int:
+    """Counts the business days of the city between two dates. See `BusinessCalendar`."""
+    return business_calendar(city_type, has_adm_decisions).business_days_between(start_date, end_date)
+
+
+def business_days_in_month(year: int,
+                           month: int,
+                           city_type: CityType = CityType.CURITIBA,
+                           has_adm_decisions: bool = True) -> int:
+    """Counts the business days of a month in the city. See `BusinessCalendar`."""
+    return business_calendar(city_type, has_adm_decisions).business_days_in_month(year, month)
@@ -0,0 +1,595 @@
+from datetime import date
+from enum import Enum
+from functools import lru_cache
+from typing import Any, List, Optional, Union, Callable
+
+import json
+import os
+import threading
+
+import numpy as np
+
+from db.models import HolidayType
+from utils.bridge_days import resolve_bridge_days
+from utils.utils import LRUCache, root_path
+
+default_rules_path = os.environ.get('LACTEC_HOLIDAY_RULES',
+                                    os.path.join(root_path, 'data', 'holiday_rules.json'))
+"""Rules file used by the application (environment variable `LACTEC_HOLIDAY_RULES`)."""
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+"""Ordinal of `numpy.datetime64` day zero, used to convert between both representations."""
+
+RULE_KINDS = ('fixed', 'easter', 'nth_weekday')
+"""Kinds of rule:
+    - `fixed`: `month` and `day`.
+    - `easter`: `offset` days from Easter.
+    - `nth_weekday`: the `n`-th `weekday` (0 is monday) of the `month`; a negative `n`
+      counts from the end of the month (-1 is the last).
+
+Every rule has a `reason` and, optionally, a `type` (:obj:`HolidayType` name), the years
+it is valid (`valid_from`, `valid_until`) and if it can generate a bridge day (`bridge`,
+`true` by default; the administrative decisions never generate one)."""
+
+
+# Adapted from: https://astroparsec.com/es/2021/04/02/a-pascoa-e-a-lua
+def calc_easter_range(start_year: int, end_year: int) -> np.ndarray:
+    """Calculate the dates of Easter for a range of years in a single array operation.
+
+    Same algorithm as `utils.holidays.calc_easter`, applied to every year at once.
+
+    Arguments:
+        start_year (int): First year of the range.
+        end_year (int): Last year of the range (inclusive).
+
+    Returns:
+        numpy.ndarray: `datetime64[D]` array with the date of Easter of each year.
+    """
+    y = np.arange(start_year, end_year + 1, dtype=np.int64)
+    g = y % 19 + 1 # Aureal Number
+    c = y // 100 + 1
+    x = 3 * c // 4 - 12
+    z = (8 * c + 5) // 25 - 5
+    d = 5 * y // 4 - x - 10
+    e = (11 * g + 20 + z - x) % 30
+
+    # Epacta
+    e = np.where(((e == 25) & (g > 11)) | (e == 24), e + 1, e)
+
+    # Meton Cycle: n is the day counted from March 1st (n > 31 falls in April)
+    n = 44 - e
+    n = np.where(n < 21, n + 30, n)
+    n = n + 7 - (d + n) % 7
+
+    march_first = (y - 1970).astype('datetime64[Y]').astype('datetime64[M]') + 2
+    return march_first.astype('datetime64[D]') + (n - 1)
+
+
+class EasterTable:
+    """Precomputed date ordinals of Easter by year.
+
+    The table is computed once for a wide range of years and is only recomputed when a
+    year outside of it is requested. The range and the table are published together as
+    one immutable tuple, so the threads reading it never mix the range of a table with
+    another table.
+
+    Arguments:
+        start_year (int): First year of the initial range.
+        end_year (int): Last year of the initial range (inclusive).
+    """
+    def __init__(self, start_year: int = 1583, end_year: int = 2600):
+        self.start_year = start_year
+        self.end_year = end_year
+        self.state = None
+        """(first year, last year, read-only table) of the current table."""
+        self.lock = threading.Lock()
+        """Serializes the recomputations of the table."""
+
+
+    def ensure(self, start_year: int, end_year: int) -> tuple:
+        """Makes sure the table covers the range of years.
+
+        Arguments:
+            start_year (int): First year of the range.
+            end_year (int): Last year of the range (inclusive).
+
+        Returns:
+            tuple: (first year, last year, table) of a table that covers the range.
+        """
+        state = self.state
+        if state is not None and state[0] <= start_year and end_year <= state[1]:
+            return state
+
+        with self.lock:
+            state = self.state
+            if state is not None and state[0] <= start_year and end_year <= state[1]:
+                return state
+            first_year, last_year = (self.start_year, self.end_year) if state is None \
+                else state[:2]
+            first_year = min(start_year, first_year)
+            last_year = max(end_year, last_year)
+            table = calc_easter_range(first_year, last_year).astype(np.int64) + EPOCH_ORDINAL
+            table.flags.writeable = False
+            self.state = (first_year, last_year, table)
+            return self.state
+
+
+    def rows(self, start_year: int, end_year: int) -> np.ndarray:
+        """Returns the date ordinals of Easter of a range of years.
+
+        Arguments:
+            start_year (int): First year of the range.
+            end_year (int): Last year of the range (inclusive).
+
+        Returns:
+            numpy.ndarray: One ordinal per year (read-only).
+        """
+        first_year, _, table = self.ensure(start_year, end_year)
+        first = start_year - first_year
+        return table[first:first + end_year - start_year + 1]
+
+
+easter_table = EasterTable()
+"""Shared table of the dates of Easter read by the rules."""
+
+
+def fixed_date_ordinals(years: np.ndarray, month, day) -> np.ndarray:
+    """Calculate the date ordinals of a fixed day and month for many years.
+
+    Arguments:
+        years (numpy.ndarray): The years.
+        month (int or numpy.ndarray): Month of the date, broadcast with the years.
+        day (int or numpy.ndarray): Day of the date, broadcast with the years.
+
+    Returns:
+        numpy.ndarray: Date ordinals.
+    """
+    months = (years - 1970).astype('datetime64[Y]').astype('datetime64[M]') + (month - 1)
+    days = months.astype('datetime64[D]') + (day - 1)
+    return days.astype(np.int64) + EPOCH_ORDINAL
+
+
+def nth_weekday_ordinals(years: np.ndarray, month, weekday, n) -> np.ndarray:
+    """Calculate the date ordinals of the n-th weekday of a month for many years.
+
+    Arguments:
+        years (numpy.ndarray): The years.
+        month (int or numpy.ndarray): The month, broadcast with the years.
+        weekday (int or numpy.ndarray): Day of the week, where monday is 0.
+        n (int or numpy.ndarray): 1 is the first weekday of the month, -1 the last.
+
+    Returns:
+        numpy.ndarray: Date ordinals.
+    """
+    first = fixed_date_ordinals(years, month, 1)
+    last = fixed_date_ordinals(years, month + 1, 1) - 1 # month 13 is january of next year
+    from_first = first + (weekday - (first + 6) % 7) % 7 + (n - 1) * 7
+    from_last = last - ((last + 6) % 7 - weekday) % 7 + (n + 1) * 7
+    return np.where(n > 0, from_first, from_last)
+
+
+def month_ordinal(year: int, month: int) -> int:
+    """Returns the date ordinal of the first day of a month; month 13 is january of the
+    next year, as in `fixed_date_ordinals`.
+    """
+    return date(year + (month - 1) // 12, (month - 1) % 12 + 1, 1).toordinal()
+
+
+def city_id(city: Union[Enum, int]) -> int:
+    """Returns the id of a city given as a `CityType` or as its id."""
+    return city.value if isinstance(city, Enum) else int(city)
+
+
+class RuleLayer:
+    """Rules of a layer of holidays (national, administrative or a city's), compiled into
+    arrays so every rule is evaluated for many years at once.
+
+    Arguments:
+        rules (dict list): Rules as loaded from the rules file, in the order the
+            holidays are added.
+        default_type (:obj:`HolidayType`): Type of the rules without a `type`.
+        is_local (bool): `True` if the holidays are city's only.
+        reason_code (callable): Returns the code of a reason in the shared string table.
+    """
+    def __init__(self,
+                 rules: List[dict],
+                 default_type: HolidayType,
+                 is_local: bool,
+                 reason_code: Callable[[str], int]):
+        for rule in rules:
+            if rule.get('kind') not in RULE_KINDS:
+                raise ValueError(f'Unknown holiday rule kind: {rule.get("kind")!r}')
+
+        def column(name: str, default: int = 0, dtype=np.int64) -> np.ndarray:
+            return np.array([rule.get(name, default) for rule in rules], dtype=dtype)
+
+        self.size = len(rules)
+        self.kind = np.array([RULE_KINDS.index(rule['kind']) for rule in rules], dtype=np.int8)
+        self.month = column('month', 1)
+        self.day = column('day', 1)
+        self.offset = column('offset')
+        self.weekday = column('weekday')
+        self.n = column('n', 1)
+        self.valid_from = np.array([rule.get('valid_from') or -2**31 for rule in rules],
+                                   dtype=np.int64)
+        self.valid_until = np.array([rule.get('valid_until') or 2**31 for rule in rules],
+                                    dtype=np.int64)
+        self.reasons = [rule['reason'] for rule in rules]
+        self.reason = np.array([reason_code(reason) for reason in self.reasons],
+                               dtype=np.int16)
+        self.type = np.array([HolidayType[rule['type']].code if 'type' in rule
+                              else self.kind_default_type(rule['kind'], default_type).code
+                              for rule in rules], dtype=np.int8)
+        self.is_local = np.full(self.size, is_local, dtype=bool)
+        self.bridge = np.array([rule.get('bridge', True) for rule in rules], dtype=bool) & \
+            (self.type != HolidayType.ADMINISTRATIVE_DECISION.code)
+        self.rules = list(zip(self.kind.tolist(), self.month.tolist(), self.day.tolist(),
+                              self.offset.tolist(), self.weekday.tolist(), self.n.tolist(),
+                              self.valid_from.tolist(), self.valid_until.tolist()))
+        """Columns of each rule as Python values, read by `evaluate_year`."""
+        self.row_values = list(zip(self.reasons, self.type.tolist(), self.is_local.tolist(),
+                                   self.bridge.tolist()))
+        """(reason, type code, is local, can bridge) of each rule."""
+        self.year_cache = LRUCache(maxsize=256)
+        """Rows of `year_rows` by year."""
+
+
+    @staticmethod
+    def kind_default_type(kind: str, default_type: HolidayType) -> HolidayType:
+        """Type of a rule without `type`: Easter based national holidays are mobile."""
+        if kind == 'easter' and default_type == HolidayType.NATIONAL_HOLIDAY:
+            return HolidayType.MOBILE_HOLIDAY
+        return default_type
+
+
+    def ordinals(self, start_year: int, end_year: int) -> np.ndarray:
+        """Evaluates every rule for a range of years.
+
+        Arguments:
+            start_year (int): First year.
+            end_year (int): Last year (inclusive).
+
+        Returns:
+            numpy.ndarray: Date ordinals with one row per year and one column per rule.
+        """
+        years = np.arange(start_year, end_year + 1, dtype=np.int64)[:, np.newaxis]
+        result = np.zeros((len(years), self.size), dtype=np.int64)
+        kind = self.kind
+
+        fixed = kind == 0
+        if fixed.any():
+            result[:, fixed] = fixed_date_ordinals(years, self.month[fixed], self.day[fixed])
+        easter = kind == 1
+        if easter.any():
+            result[:, easter] = easter_table.rows(start_year, end_year)[:, np.newaxis] + \
+                self.offset[easter]
+        nth = kind == 2
+        if nth.any():
+            result[:, nth] = nth_weekday_ordinals(years, self.month[nth],
+                                                  self.weekday[nth], self.n[nth])
+        return result
+
+
+    def valid(self, start_year: int, end_year: int) -> np.ndarray:
+        """Returns which rules are valid in each year of a range (same shape as `ordinals`)."""
+        years = np.arange(start_year, end_year + 1, dtype=np.int64)[:, np.newaxis]
+        return (years >= self.valid_from) & (years <= self.valid_until)
+
+
+    def year_rows(self, year: int) -> tuple:
+        """Evaluates the rules valid in a year. The rows are cached by year, so building
+        the holidays of a year again does not evaluate the rules.
+
+        Arguments:
+            year (int): The year.
+
+        Returns:
+            tuple: (ordinal, reason, type code, is local, can bridge) of each valid rule,
+                in the order of the rules.
+        """
+        return self.year_cache.get_or_create(year, lambda: self.evaluate_year(year))
+
+
+    def evaluate_year(self, year: int) -> tuple:
+        """Evaluates the rules valid in a year, without the cache of `year_rows`. A single
+        year is evaluated in plain Python, which is faster than the arrays of `ordinals`.
+        """
+        rows = []
+        easter = None
+        for i, (kind, month, day, offset, weekday, n, valid_from, valid_until) in \
+                enumerate(self.rules):
+            if not valid_from <= year <= valid_until:
+                continue
+            if kind == 0:
+                ordinal = month_ordinal(year, month) + day - 1
+            elif kind == 1:
+                if easter is None:
+                    first_year, _, table = easter_table.ensure(year, year)
+                    easter = int(table[year - first_year])
+                ordinal = easter + offset
+            elif n > 0:
+                first = month_ordinal(year, month)
+                ordinal = first + (weekday - (first + 6) % 7) % 7 + (n - 1) * 7
+            else:
+                last = month_ordinal(year, month + 1) - 1
+                ordinal = last - ((last + 6) % 7 - weekday) % 7 + (n + 1) * 7
+            rows.append((ordinal,) + self.row_values[i])
+        return tuple(rows)
+
+
+class CityRules:
+    """City of the rules file and its local holidays.
+
+    Arguments:
+        data (dict): City as loaded from the rules file.
+        reason_code (callable): Returns the code of a reason in the shared string table.
+    """
+    def __init__(self, data: dict, reason_code: Callable[[str], int]):
+        self.id = int(data['id'])
+        self.name = data['name']
+        self.has_adm_decisions = data.get('has_adm_decisions', True)
+        self.holidays = RuleLayer(data.get('holidays', []),
+                                  HolidayType.LOCAL_HOLIDAY,
+                                  True,
+                                  reason_code)
+
+
+class HolidayRules:
+    """Holiday rules of all the cities, compiled into an evaluator that computes many
+    years and cities in one batch.
+
+    The holidays of a city are, in this order: the national rules, its local rules, the
+    administrative rules (if the city has administrative decisions) and the bridge days.
+    A holiday on a tuesday bridges the monday before it and a holiday on a thursday
+    bridges the friday after it, unless that day is already a holiday of the same year.
+
+    Arguments:
+        data (dict): Rules file content: `bridge_day`, `national`, `administrative` and
+            `cities`. See `RULE_KINDS`.
+    """
+    def __init__(self, data: dict):
+        self.reasons = {}
+        """Code of each reason, in the order they were found."""
+        self.bridge_reason = data.get('bridge_day', {}).get('reason', 'Dia ponte')
+        self.bridge_code = self.reason_code(self.bridge_reason)
+        self.national = RuleLayer(data.get('national', []),
+                                  HolidayType.NATIONAL_HOLIDAY,
+                                  False,
+                                  self.reason_code)
+        self.administrative = RuleLayer(data.get('administrative', []),
+                                        HolidayType.ADMINISTRATIVE_DECISION,
+                                        False,
+                                        self.reason_code)
+        self.cities = {}
+        for city_data in data.get('cities', []):
+            city = CityRules(city_data, self.reason_code)
+            self.cities[city.id] = city
+
+
+    @classmethod
+    def load(cls, path: str = default_rules_path) -> 'HolidayRules':
+        """Loads and compiles a rules file.
+
+        Arguments:
+            path (str, optional): Path of the JSON rules file.
+        """
+        with open(path, encoding='utf-8') as file:
+            return cls(json.load(file))
+
+
+    def reason_code(self, reason: str) -> int:
+        """Returns the code of a reason, adding it to the string table if needed."""
+        return self.reasons.setdefault(reason, len(self.reasons))
+
+
+    def city(self, city: Union[Enum, int]) -> CityRules:
+        """Returns the rules of a city given as a `CityType` or as its id."""
+        try:
+            return self.cities[city_id(city)]
+        except KeyError:
+            raise ValueError(f'No holiday rules for the city {city!r}') from None
+
+
+    def layer_rows(self,
+                   start_year: int,
+                   end_year: int,
+                   layers: List[RuleLayer]) -> dict:
+        """Evaluates layers of rules for a range of years.
+
+        Arguments:
+            start_year (int): First year.
+            end_year (int): Last year (inclusive).
+            layers (:obj:`RuleLayer` list): The layers, in the order the holidays are added.
+
+        Returns:
+            dict: Arrays `year`, `ordinal`, `reason`, `type`, `is_local`, `bridge` and `seq`
+                (index of the rule in the layers) of the valid rules, sorted by year and
+                insertion order.
+        """
+        years = np.arange(start_year, end_year + 1, dtype=np.int64)
+        ordinals = np.concatenate([layer.ordinals(start_year, end_year) for layer in layers],
+                                  axis=1)
+        valid = np.concatenate([layer.valid(start_year, end_year) for layer in layers],
+                               axis=1).ravel()
+        seq = np.broadcast_to(np.arange(ordinals.shape[1], dtype=np.int32), ordinals.shape)
+        rows = {'year': np.broadcast_to(years[:, np.newaxis], ordinals.shape).ravel()[valid],
+                'ordinal': ordinals.ravel()[valid],
+                'seq': seq.ravel()[valid]}
+        for name in ('reason', 'type', 'is_local', 'bridge'):
+            column = np.concatenate([getattr(layer, name) for layer in layers])
+            rows[name] = column[rows['seq']]
+        return rows
+
+
+    def add_bridge_days(self, rows: dict, taken: Optional[dict] = None) -> dict:
+        """Adds the bridge days of the holidays of `rows`.
+
+        A holiday on a tuesday bridges the monday before it, and a holiday on a thursday
+        bridges the friday after it, unless that day is already a holiday of the same year
+        (of `rows` or `taken`). The first holiday (in insertion order) that claims a day
+        wins. The days are decided by `resolve_bridge_days` over the rows sorted by date.
+
+        Arguments:
+            rows (dict): Holidays returned by `layer_rows`.
+            taken (dict, optional): Other holidays (arrays `year` and `ordinal`) that
+                block the bridge days but do not generate them.
+
+        Returns:
+            dict: The rows followed by the bridge days, which have the `seq` of their
+                holiday plus the number of rules, so they sort after every rule.
+        """
+        order = np.lexsort((rows['seq'], rows['ordinal']))
+        if taken is None:
+            taken = {'ordinal': np.empty(0, dtype=np.int64), 'year': np.empty(0, dtype=np.int64)}
+        taken_order = np.argsort(taken['ordinal'], kind='stable')
+        resolved = resolve_bridge_days(rows['ordinal'][order].tolist(),
+                                       rows['bridge'][order].tolist(),
+                                       rows['year'][order].tolist(),
+                                       taken['ordinal'][taken_order].tolist(),
+                                       taken['year'][taken_order].tolist())
+        source = order[np.array([index for index, _ in resolved], dtype=np.int64)]
+        size = len(source)
+
+        n_rules = int(rows['seq'].max()) + 1 if len(rows['seq']) else 0
+        bridges = {'year': rows['year'][source],
+                   'ordinal': np.array([ordinal for _, ordinal in resolved],
+                                       dtype=rows['ordinal'].dtype),
+                   'seq': (n_rules + rows['seq'][source]).astype(np.int32),
+                   'reason': np.full(size, self.bridge_code, dtype=np.int16),
+                   'type': np.full(size, HolidayType.ADMINISTRATIVE_DECISION.code, dtype=np.int8),
+                   'is_local': rows['is_local'][source],
+                   'bridge': np.zeros(size, dtype=bool)}
+        return {name: np.concatenate((rows[name], bridges[name])) for name in rows}
+
+
+    def sorted_columns(self, rows: dict) -> dict:
+        """Returns the rows sorted by date and insertion order, without the internal
+        columns, plus the `reasons` string table."""
+        order = np.lexsort((rows['seq'], rows['ordinal']))
+        columns = {name: rows[name][order] for name in ('year', 'ordinal', 'reason',
+                                                          'type', 'is_local')}
+        columns['reasons'] = list(self.reasons)
+        return columns
+
+
+    def national_layer(self, start_year: int, end_year: int) -> dict:
+        """Generates the layer shared by all the cities: the national holidays, the
+        administrative decisions and the bridge days of the national holidays.
+
+        The cities without administrative decisions get the national holidays of this
+        layer only, as the bridge days are administrative decisions too.
+
+        Arguments:
+            start_year (int): First year.
+            end_year (int): Last year (inclusive).
+
+        Returns:
+            dict: Arrays `year`, `ordinal`, `reason` (code in `reasons`), `type`
+                (:obj:`HolidayType` code) and `is_local`, sorted by date and insertion
+                order, plus the `reasons` string table.
+        """
+        rows = self.layer_rows(start_year, end_year, [self.national, self.administrative])
+        return self.sorted_columns(self.add_bridge_days(rows))
+
+
+    def city_layer(self,
+                   start_year: int,
+                   end_year: int,
+                   city: Union[Enum, int],
+                   has_adm_decisions: Optional[bool] = None,
+                   national: Optional[dict] = None) -> dict:
+        """Generates the delta layer of a city over the national layer: its local
+        holidays and, if it has administrative decisions, their bridge days.
+
+        A bridge day of a local holiday is not added if the day is already a holiday of
+        the national layer. A local holiday on a national bridge day is kept, so the day
+        appears in both layers.
+
+        Arguments:
+            start_year (int): First year.
+            end_year (int): Last year (inclusive).
+            city (:obj:`CityType` or int): The city, or its id.
+            has_adm_decisions (bool, optional): If the city has administrative decisions.
+                The default is the value of the rules.
+            national (dict, optional): `national_layer` of the same years, if already
+                generated.
+
+        Returns:
+            dict: Same arrays as `national_layer`.
+        """
+        city_rules = self.city(city)
+        if has_adm_decisions is None:
+            has_adm_decisions = city_rules.has_adm_decisions
+        rows = self.layer_rows(start_year, end_year, [city_rules.holidays])
+        if has_adm_decisions:
+            if national is None:
+                national = self.national_layer(start_year, end_year)
+            rows = self.add_bridge_days(rows, national)
+        return self.sorted_columns(rows)
+
+
+    def evaluate(self,
+                 start_year: int,
+                 end_year: int,
+                 cities: Optional[List[Union[Enum, int]]] = None,
+                 has_adm_decisions: Union[bool, dict] = True) -> dict:
+        """Generates the holidays of many years and cities in columnar form.
+
+        Each city gets all its holidays, as `utils.holidays.Holidays`: the national rules,
+        its local rules, the administrative rules (if the city has administrative
+        decisions) and the bridge days of all of them. The rules are evaluated with
+        array operations for all the years at once.
+
+        Arguments:
+            start_year (int): First year.
+            end_year (int): Last year (inclusive).
+            cities (list, optional): Cities (`CityType` or id) to generate. The default is
+                all the cities of the rules.
+            has_adm_decisions (bool or dict, optional): If the administrative decisions are
+                generated, for all cities or by city (`CityType` or id). The default is `True`.
+
+        Returns:
+            dict: Arrays `city` (id), `year`, `ordinal`, `reason` (code in `reasons`),
+                `type` (:obj:`HolidayType` code) and `is_local`, sorted by city, date and
+                insertion order, plus the `reasons` string table.
+        """
+        if cities is None:
+            cities = list(self.cities)
+        if isinstance(has_adm_decisions, dict):
+            has_adm_decisions = {city_id(city): value
+                                 for city, value in has_adm_decisions.items()}
+
+        names = ('city', 'year', 'ordinal', 'reason', 'type', 'is_local')
+        columns = {name: [] for name in names}
+        for city in cities:
+            city_rules = self.city(city)
+            city_adm = has_adm_decisions.get(city_rules.id, True) \
+                if isinstance(has_adm_decisions, dict) \
+                else has_adm_decisions
+
+            layers = [self.national, city_rules.holidays]
+            if city_adm:
+                layers.append(self.administrative)
+            rows = self.layer_rows(start_year, end_year, layers)
+            if city_adm:
+                rows = self.add_bridge_days(rows)
+
+            city_columns = self.sorted_columns(rows)
+            city_columns['city'] = np.full(len(city_columns['ordinal']),
+                                           city_rules.id,
+                                           dtype=np.int16)
+            for name in names:
+                columns[name].append(city_columns[name])
+
+        columns = {name: np.concatenate(value) if value else np.empty(0, dtype=np.int64)
+                   for name, value in columns.items()}
+        order = np.argsort(columns['city'], kind='stable')
+        columns = {name: value[order] for name, value in columns.items()}
+        columns['reasons'] = list(self.reasons)
+        return columns
+
+
+@lru_cache(maxsize=None)
+def holiday_rules() -> HolidayRules:
+    """Returns the compiled rules of `default_rules_path`, loaded on the first call."""
+    return HolidayRules.load(default_rules_path)
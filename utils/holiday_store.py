@@ -0,0 +1,215 @@
+from datetime import date
+from functools import lru_cache
+from typing import Any, List, Optional, Union, Callable
+
+import json
+import os
+
+import numpy as np
+
+from db.log_writer import log_writer
+from db.models import HolidayType, HOLIDAY_TYPES, LogType
+from utils.holiday_rules import city_id, holiday_rules
+from utils.utils import root_path
+import db.database as db
+
+default_store_path = os.environ.get('LACTEC_HOLIDAY_STORE',
+                                    os.path.join(root_path, 'holiday_store'))
+"""Folder of the store used by the application (environment variable `LACTEC_HOLIDAY_STORE`)."""
+
+STORE_VERSION = 1
+
+
+def holidays_groups(start_year: int,
+                    end_year: int,
+                    cities: Optional[dict] = None,
+                    national: bool = True) -> dict:
+    """Generates the holidays of a range of years in the groups saved in the database: the
+    national layer in the group 0 and the delta layer of each city in the group of its id
+    (see `Holidays.layers`).
+
+    Arguments:
+        start_year (int): First year.
+        end_year (int): Last year (inclusive).
+        cities (dict, optional): `has_adm_decisions` by city (`CityType` or id). The
+            default is all the cities of the holiday rules.
+        national (bool, optional): If the national layer is included. The default is `True`.
+
+    Returns:
+        dict: Arrays `ordinal`, `reason` (code in `reasons`), `type` (:obj:`HolidayType`
+            code) and `group`, sorted by group and date, plus the `reasons` string table.
+    """
+    rules = holiday_rules()
+    if cities is None:
+        cities = {city.id: city.has_adm_decisions for city in rules.cities.values()}
+
+    national_layer = rules.national_layer(start_year, end_year)
+    layers = [(0, national_layer)] if national else []
+    for city, has_adm_decisions in cities.items():
+        layers.append((city_id(city), rules.city_layer(start_year,
+                                                       end_year,
+                                                       city,
+                                                       has_adm_decisions,
+                                                       national_layer)))
+
+    columns = {name: np.concatenate([layer[name] for _, layer in layers])
+               if layers else np.empty(0, dtype=np.int64)
+               for name in ('ordinal', 'reason', 'type')}
+    columns['group'] = np.concatenate([np.full(len(layer['ordinal']), group, dtype=np.int16)
+                                       for group, layer in layers]) \
+        if layers else np.empty(0, dtype=np.int16)
+    columns['reasons'] = list(rules.reasons)
+    return columns
+
+
+def build_store(path: str,
+                start_year: int,
+                end_year: int,
+                cities: Optional[dict] = None):
+    """Writes the holidays of a range of years to a store folder.
+
+    Every group (0 and one by city, even without holidays) has three `.npy` files sorted
+    by date: `group_<n>.ordinal.npy` (int32 date
+    ordinals), `group_<n>.type.npy` (int8 `HolidayType` codes) and `group_<n>.reason.npy`
+    (int16 codes in the `reasons` table of `meta.json`). `meta.json` is written last, so
+    a store being rebuilt is never read half written.
+
+    Arguments:
+        path (str): Folder of the store. Created if it does not exist.
+        start_year (int): First year.
+        end_year (int): Last year (inclusive).
+        cities (dict, optional): `has_adm_decisions` by city (`CityType` or id). The
+            default is all the cities of the holiday rules.
+    """
+    if cities is None:
+        cities = {city.id: city.has_adm_decisions for city in holiday_rules().cities.values()}
+    columns = holidays_groups(start_year, end_year, cities)
+    groups = {}
+    for group in [0] + [city_id(city) for city in cities]:
+        rows = columns['group'] == group
+        groups[group] = {'ordinal': columns['ordinal'][rows].astype(np.int32),
+                         'type': columns['type'][rows].astype(np.int8),
+                         'reason': columns['reason'][rows].astype(np.int16)}
+
+    os.makedirs(path, exist_ok=True)
+    for group, arrays in groups.items():
+        for name, array in arrays.items():
+            file_name = os.path.join(path, f'group_{group}.{name}.npy')
+            with open(file_name + '.tmp', 'wb') as file:
+                np.save(file, array)
+            os.replace(file_name + '.tmp', file_name)
+
+    meta = {'version': STORE_VERSION,
+            'start_year': start_year,
+            'end_year': end_year,
+            'groups': sorted(groups),
+            'reasons': columns['reasons']}
+    with open(os.path.join(path, 'meta.json.tmp'), 'w', encoding='utf-8') as file:
+        json.dump(meta, file, ensure_ascii=False)
+    os.replace(os.path.join(path, 'meta.json.tmp'), os.path.join(path, 'meta.json'))
+
+
+class HolidayStore:
+    """Read-only holidays of a store folder written by `build_store`.
+
+    The arrays are memory-mapped, so the pages are loaded on demand and shared by every
+    process that opens the same store, and the queries do not use the database.
+
+    Arguments:
+        path (str): Folder of the store.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as file:
+            meta = json.load(file)
+        if meta['version'] != STORE_VERSION:
+            raise ValueError(f'Versão do armazenamento de feriados não suportada: {meta["version"]}')
+        self.start_year = meta['start_year']
+        self.end_year = meta['end_year']
+        self.reasons = meta['reasons']
+        self.groups = {}
+        for group in meta['groups']:
+            self.groups[group] = {
+                name: np.load(os.path.join(path, f'group_{group}.{name}.npy'), mmap_mode='r')
+                for name in ('ordinal', 'type', 'reason')}
+
+
+    def covers(self, start_date: date, end_date: date) -> bool:
+        """Checks if the store has the holidays of every day between two dates."""
+        return self.start_year <= start_date.year and end_date.year <= self.end_year
+
+
+    def has_group(self, group: int) -> bool:
+        """Checks if the store has the holidays of a group, e.g. a city added to the
+        rules after the store was built does not have them."""
+        return group in self.groups
+
+
+    def group_holidays(self,
+                       group: int,
+                       start_ordinal: int,
+                       end_ordinal: int) -> List[tuple]:
+        """Returns the (ordinal, type code, reason code) of a group between two ordinals
+        (inclusive), found by binary search."""
+        arrays = self.groups.get(group)
+        if arrays is None:
+            return []
+        ordinals = arrays['ordinal']
+        start = np.searchsorted(ordinals, start_ordinal, side='left')
+        end = np.searchsorted(ordinals, end_ordinal, side='right')
+        return list(zip(ordinals[start:end].tolist(),
+                        arrays['type'][start:end].tolist(),
+                        arrays['reason'][start:end].tolist()))
+
+
+    def get_holidays(self,
+                     group: int,
+                     has_adm_decisions: bool,
+                     start_date: date,
+                     end_date: date) -> List[dict]:
+        """Returns the holidays of a city's group between two dates (inclusive), like
+        `db.database.get_holidays`.
+
+        Arguments:
+            group (int): Group of the city. The national holidays (group 0) are included.
+            has_adm_decisions (bool): If the administrative decisions are included.
+            start_date (date): First date.
+            end_date (date): Last date.
+
+        Returns:
+            dict list: Holidays (date, reason and type) sorted by date, the local
+                holidays first.
+        """
+        start_ordinal, end_ordinal = start_date.toordinal(), end_date.toordinal()
+        rows = []
+        if group != 0:
+            rows += self.group_holidays(group, start_ordinal, end_ordinal)
+        rows += self.group_holidays(0, start_ordinal, end_ordinal)
+        rows.sort(key=lambda row: row[0])
+
+        administrative = HolidayType.ADMINISTRATIVE_DECISION.code
+        return [{"date": date.fromordinal(ordinal),
+                 "reason": self.reasons[reason],
+                 "type": HOLIDAY_TYPES[type]}
+                for ordinal, type, reason in rows
+                if has_adm_decisions or type != administrative]
+
+
+@lru_cache(maxsize=None)
+def default_store() -> Optional[HolidayStore]:
+    """Returns the store of `default_store_path`, or `None` if it was not built."""
+    if not os.path.exists(os.path.join(default_store_path, 'meta.json')):
+        return None
+    try:
+        store = HolidayStore(default_store_path)
+    except Exception as e:
+        db.save_log_message(None, LogType.ERROR, e)
+        return None
+
+    missing = [city.id for city in holiday_rules().cities.values()
+               if not store.has_group(city.id)]
+    if missing:
+        log_writer.write(LogType.WARNING,
+                         f'Armazenamento de feriados sem as cidades {missing}: '
+                         f'execute prewarm.py --store; elas são lidas do banco.')
+    return store
@@ -1,11 +1,18 @@
+from bisect import bisect_left, bisect_right
 from datetime import date, datetime, timedelta
-from collections import OrderedDict
+from collections.abc import Mapping
 from enum import Enum
-from typing import Any, List, Optional, Union, Callable
-import pandas as pd
-import pdb
+from typing import Any, List, Optional, Union, Callable, TYPE_CHECKING
+import numpy as np
 
-from db.models import HolidayType
+if TYPE_CHECKING:
+    import pandas as pd
+
+from db.models import HolidayType, HOLIDAY_TYPES
+from utils.holiday_rules import EPOCH_ORDINAL, calc_easter_range
+from utils.bridge_days import resolve_bridge_days
+from utils.holiday_rules import RuleLayer, holiday_rules
+from utils.utils import LRUCache
 
 
 # Referências:
@@ -18,6 +25,8 @@ weeks = ['Segunda-feira', 'Terça-feira', 'Quarta-feira', 'Quinta-feira', 'Sexta
 
 
 class CityType(Enum):
+    """Ids of the cities of the default rules file (`data/holiday_rules.json`). Any city of
+    the rules can also be given by its id."""
     CURITIBA = 1
     SALVADOR = 2
     NAVEGANTES = 3
@@ -58,13 +67,126 @@ def calc_easter(year):
     return date(y, m, n)
 
 
+def holidays_columns(start_year: int,
+                     end_year: int,
+                     cities: Optional[List[Union[CityType, int]]] = None,
+                     has_adm_decisions: Union[bool, dict] = True) -> dict:
+    """Generates the holidays of many years and cities in columnar form.
+
+    The result has the same rows as `Holidays(year, city).sorted` for every year and
+    city, sorted by city, date and insertion order. See `HolidayRules.evaluate`.
+
+    Arguments:
+        start_year (int): First year.
+        end_year (int): Last year (inclusive).
+        cities (list, optional): Cities (`CityType` or id) to generate. The default is all.
+        has_adm_decisions (bool or dict, optional): If the administrative decisions are
+            generated, for all cities or by city. The default is `True`.
+
+    Returns:
+        dict: Arrays `city` (id), `year`, `ordinal`, `reason` (code in `reasons`), `type`
+            (:obj:`HolidayType` code) and `is_local`, plus the `reasons` string table.
+    """
+    return holiday_rules().evaluate(start_year, end_year, cities, has_adm_decisions)
+
+
+class HolidayRecord(Mapping):
+    """Immutable, compact record of a holiday.
+
+    The date is stored as an ordinal and the type as its `HolidayType.code`. For
+    compatibility with the former dictionaries, the record is also a read-only mapping
+    with the keys `date`, `Day`, `reason`, `type` and `is_local`, so `record['date']`,
+    `dict(record)` and `pd.DataFrame(records)` keep working.
+
+    Arguments:
+        ordinal (int): Date ordinal.
+        reason (str): Reason for the holiday.
+        type_code (int): Code of the holiday type.
+        is_local (bool): `True` if holiday is city's only.
+    """
+    __slots__ = ('ordinal', 'reason', 'type_code', 'is_local')
+
+    keys_list = ("date", "Day", "reason", "type", "is_local")
+
+    def __init__(self, ordinal: int, reason: str, type_code: int, is_local: bool = False):
+        object.__setattr__(self, 'ordinal', ordinal)
+        object.__setattr__(self, 'reason', reason)
+        object.__setattr__(self, 'type_code', type_code)
+        object.__setattr__(self, 'is_local', is_local)
+
+
+    def __setattr__(self, name, value):
+        raise AttributeError('HolidayRecord is immutable')
+
+
+    @property
+    def date(self) -> date:
+        """Date of the holiday."""
+        return date.fromordinal(self.ordinal)
+
+
+    @property
+    def type(self) -> HolidayType:
+        """Type of the holiday."""
+        return HOLIDAY_TYPES[self.type_code]
+
+
+    @property
+    def weekday(self) -> int:
+        """Day of the week, where monday is 0 and sunday is 6."""
+        return (self.ordinal + 6) % 7
+
+
+    @property
+    def day(self) -> str:
+        """Name of the day of the week, derived from the date."""
+        return weeks[self.weekday]
+
+
+    def __getitem__(self, key: str):
+        if key == "date":
+            return self.date
+        if key == "Day":
+            return self.day
+        if key == "reason":
+            return self.reason
+        if key == "type":
+            return self.type
+        if key == "is_local":
+            return self.is_local
+        raise KeyError(key)
+
+
+    def __iter__(self):
+        return iter(self.keys_list)
+
+
+    def __len__(self):
+        return len(self.keys_list)
+
+
+    def __hash__(self):
+        return hash((self.ordinal, self.reason, self.type_code, self.is_local))
+
+
+    def __repr__(self):
+        return f'HolidayRecord(date={self.date!r}, reason={self.reason!r}, ' \
+            f'type={self.type}, is_local={self.is_local})'
+
+
 class Holidays:
     """Class that returns a list of public holiday data (holidays), including administrative decisions.
 
     Arguments:
         year (int): The reference year.
-        type_city (:obj:`TypeCity`): The type of the city: City.CURITIBA or City.SALVADOR.
+        city_type (:obj:`CityType` or int): The city, or its id in the holiday rules.
+        has_adm_decisions (bool): If the administrative decisions are added.
     """
+    cache = LRUCache(maxsize=256)
+    """Shared instances returned by `for_year` and layers returned by `layers`."""
+    layers_block = 10
+    """Years whose layers `layers` generates together, aligned to multiples of it."""
+
     def __init__(self,
                  year: int = datetime.now().year,
                  city_type: CityType = CityType.CURITIBA,
@@ -72,18 +194,142 @@ class Holidays:
         self.year = year
         self.city_type = city_type
         self.holidays = []
-        self.init_fixed_holidays()
-        self.init_mobile_holidays()
-        if city_type == CityType.CURITIBA:
-            self.init_curitiba_holidays()
-        elif city_type == CityType.SALVADOR:
-            self.init_salvador_holidays()
-        else:
-            self.init_navegantes_holidays()
-        
+        self.by_ordinal = {}
+        """Index of the holidays by date ordinal."""
+        self.by_reason = {}
+        """Index of the first holiday added for each reason."""
+        self.views = None
+        """Cached sorted views, invalidated by `add_holiday`."""
+        self.frozen = False
+        """`True` for the shared instances of `for_year`, which can not be changed (see `freeze`)."""
+        self.rules = holiday_rules()
+        self.bridge_excluded = set()
+        """Reasons of the holidays that never generate a bridge day."""
+        self.init_national_holidays()
+        self.init_local_holidays(city_type)
+
         if has_adm_decisions:
             self.init_administrative_decisions()
 
+    @classmethod
+    def for_year(cls,
+                 year: int,
+                 city_type: CityType = CityType.CURITIBA,
+                 has_adm_decisions: bool = True) -> 'Holidays':
+        """Returns the shared, immutable holidays of the year and city.
+
+        The instances are kept in a size-bounded LRU cache (`Holidays.cache`), so repeated
+        requests for the same year and city are not recomputed.
+
+        Arguments:
+            year (int): The reference year.
+            city_type (:obj:`CityType`): The type of the city.
+            has_adm_decisions (bool): If the administrative decisions are added.
+
+        Returns:
+            Holidays: The shared instance, frozen (see `freeze`).
+        """
+        def create() -> 'Holidays':
+            holidays = cls(year, city_type, has_adm_decisions)
+            holidays.freeze()
+            return holidays
+
+        return cls.cache.get_or_create((year, city_type, has_adm_decisions), create)
+
+
+    @classmethod
+    def layers(cls, year: int) -> dict:
+        """Returns the holidays of the year in layers: the national layer, shared by all the
+        cities, and the delta layer of each city of the holiday rules.
+
+        The national layer (national holidays, administrative decisions and their bridge
+        days) is generated once for all the cities. The delta layer of a city has only its
+        local holidays and their bridge days (see `HolidayRules.city_layer`), so the work
+        grows with the number of local rules. The layers are generated for the block of
+        `layers_block` years around the year, as the next years are usually requested
+        next, and every year of the block is kept in `Holidays.cache`.
+
+        Arguments:
+            year (int): The reference year.
+
+        Returns:
+            dict: Tuple of sorted `HolidayRecord` by group: 0 for the national layer and
+                the city id for each delta layer, as saved in the database.
+        """
+        def records(columns: dict) -> list:
+            reasons = columns['reasons']
+            return [HolidayRecord(ordinal, reasons[reason], type, is_local)
+                    for ordinal, reason, type, is_local in zip(columns['ordinal'].tolist(),
+                                                               columns['reason'].tolist(),
+                                                               columns['type'].tolist(),
+                                                               columns['is_local'].tolist())]
+
+        def create() -> dict:
+            rules = holiday_rules()
+            start_year = year - year % cls.layers_block
+            end_year = start_year + cls.layers_block - 1
+            years = np.arange(start_year, end_year + 1)
+            national = rules.national_layer(start_year, end_year)
+            columns = {0: national}
+            for city in rules.cities.values():
+                columns[city.id] = rules.city_layer(start_year, end_year, city.id,
+                                                    national=national)
+
+            # The rows are sorted by date, so each year is a slice of the records
+            bounds = {group: np.searchsorted(layer['year'], years).tolist() + [len(layer['year'])]
+                      for group, layer in columns.items()}
+            all_records = {group: records(layer) for group, layer in columns.items()}
+            result = None
+            for i, block_year in enumerate(years.tolist()):
+                layers = {group: tuple(items[bounds[group][i]:bounds[group][i + 1]])
+                          for group, items in all_records.items()}
+                if block_year == year:
+                    result = layers
+                elif ('layers', block_year) not in cls.cache:
+                    cls.cache.put(('layers', block_year), layers)
+            return result
+
+        return cls.cache.get_or_create(('layers', year), create)
+
+
+    @classmethod
+    def range(cls,
+              start_year: int,
+              end_year: int,
+              cities: Optional[List[CityType]] = None,
+              has_adm_decisions: Union[bool, dict] = True) -> 'pd.DataFrame':
+        """Generates the holidays of many years and cities in a single pass.
+
+        Arguments:
+            start_year (int): First year.
+            end_year (int): Last year (inclusive).
+            cities (:obj:`CityType` list, optional): Cities to generate. The default is all.
+            has_adm_decisions (bool or dict, optional): If the administrative decisions
+                are generated, for all cities or by city type. The default is `True`.
+
+        Returns:
+            DataFrame: Columns `city`, `date`, `reason`, `type` and `is_local`, with
+                categorical `city` (`CityType`, or the id of other cities), `reason`
+                and `type`. See `holidays_columns` for the
+                NumPy arrays.
+        """
+        import pandas as pd
+
+        columns = holidays_columns(start_year, end_year, cities, has_adm_decisions)
+        city_ids = [city.value for city in CityType]
+        ids, city_codes = np.unique(columns['city'], return_inverse=True)
+        city_types = [CityType(id) if id in city_ids else id for id in ids.tolist()]
+        dates = (columns['ordinal'] - EPOCH_ORDINAL).astype('datetime64[D]')
+        return pd.DataFrame({
+            'city': pd.Categorical.from_codes(city_codes, categories=city_types),
+            'date': dates,
+            'reason': pd.Categorical.from_codes(columns['reason'],
+                                                categories=columns['reasons']),
+            'type': pd.Categorical.from_codes(columns['type'],
+                                              categories=HOLIDAY_TYPES),
+            'is_local': columns['is_local'],
+        })
+
     
     def add_holiday(self, date: date,
                     reason: str,
@@ -97,34 +343,52 @@ class Holidays:
             type (str): Type: national holiday, local holiday or administrative decision.
             is_local (bool): `True` if holiday is city's only.
         """
-        global weeks
+        self.add_record(HolidayRecord(date.toordinal(), reason, type.code, is_local))
+
 
-        week_day = weeks[date.weekday()]
+    def add_record(self, record: HolidayRecord):
+        """Adds a holiday already in the compact form, as `add_holiday`.
+
+        Arguments:
+            record (:obj:`HolidayRecord`): The holiday.
+        """
+        if self.frozen:
+            raise TypeError('Shared Holidays instances can not be changed')
 
-        dicio = {"date": date,
-                 "Day": week_day,
-                 "reason": reason,
-                 "type": type,
-                 "is_local": is_local}
-        self.holidays.append(dicio)
+        self.holidays.append(record)
+        self.by_ordinal.setdefault(record.ordinal, []).append(record)
+        self.by_reason.setdefault(record.reason, record)
+        self.views = None
 
     
-    def init_fixed_holidays(self):
-        """Initializes Brazil's national holidays.
+    def freeze(self):
+        """Makes the instance immutable, so it can be shared: `add_holiday` raises
+        `TypeError`, and `holidays`, the sorted views and the date index become tuples.
+        """
+        views = self.sorted_views()
+        self.views = {name: tuple(items) for name, items in views.items()}
+        self.holidays = tuple(self.holidays)
+        self.by_ordinal = {ordinal: tuple(items) for ordinal, items in self.by_ordinal.items()}
+        self.frozen = True
+
+
+    def add_rules(self, layer: RuleLayer):
+        """Adds the holidays of the rules of a layer valid in the year.
+
+        Arguments:
+            layer (:obj:`RuleLayer`): National, administrative or city's rules.
+        """
+        adm_code = HolidayType.ADMINISTRATIVE_DECISION.code
+        for ordinal, reason, type_code, is_local, bridge in layer.year_rows(self.year):
+            self.add_record(HolidayRecord(ordinal, reason, type_code, is_local))
+            if not bridge and type_code != adm_code:
+                self.bridge_excluded.add(reason)
+
+
+    def init_national_holidays(self):
+        """Initializes Brazil's national holidays, fixed and mobile.
         """
-        type = HolidayType.NATIONAL_HOLIDAY
-        self.add_holiday(date(self.year, 1, 1), "Ano Novo", type)
-        self.add_holiday(date(self.year, 4, 21), "Tiradentes", type)
-        self.add_holiday(date(self.year, 5, 1), "Dia do Trabalhador", type)
-        self.add_holiday(date(self.year, 9, 7), "Independência do Brasil", type)
-        self.add_holiday(date(self.year, 10, 12), "Nossa Senhora Aparecida", type)
-        self.add_holiday(date(self.year, 11, 2), "Finados", type)
-        self.add_holiday(date(self.year, 11, 15), "Proclamação da República", type)
-        if self.year >= 2024:
-            self.add_holiday(date(self.year, 11, 20),
-                             "Dia Nacional de Zumbi e da Consciência Negra",
-                             type)
-        self.add_holiday(date(self.year, 12, 25), "Natal", type)
+        self.add_rules(self.rules.national)
 
 
     def add_date_days(self, data:date, dias:int):
@@ -142,52 +406,13 @@ class Holidays:
         return new_date.date()
 
 
-    def init_mobile_holidays(self):
-        """Calculates mobile holidays.
-        """
-        type = HolidayType.MOBILE_HOLIDAY
-        easter = calc_easter(self.year)
-        self.add_holiday(easter, "Páscoa", type)
-        self.add_holiday(self.add_date_days(easter, -48),
-                         "Carnaval",
-                         HolidayType.ADMINISTRATIVE_DECISION)
-        self.add_holiday(self.add_date_days(easter, -47),
-                         "Carnaval",
-                         type)
-        self.add_holiday(self.add_date_days(easter, -46),
-                         "Cinzas",
-                         HolidayType.ADMINISTRATIVE_DECISION)
-        self.add_holiday(self.add_date_days(easter, -2),
-                         "Paixão de Cristo",
-                         type)
-        self.add_holiday(self.add_date_days(easter, 60),
-                         "Corpus Christi",
-                         type)
-
-
-    def init_curitiba_holidays(self):
-        """Adds the dates of local holidays in Curitiba/PR.
-        """
-        self.add_holiday(date(self.year, 9, 8),
-                         "Nossa Senhora da Luz dos Pinhais",
-                         HolidayType.LOCAL_HOLIDAY,
-                         True)
+    def init_local_holidays(self, city_type: Union[CityType, int]):
+        """Adds the dates of local holidays of the city.
 
-    
-    def init_salvador_holidays(self):
-        """Adds the dates of local holidays in Salvador/BA.
+        Arguments:
+            city_type (:obj:`CityType` or int): The city, or its id in the holiday rules.
         """
-        type = HolidayType.LOCAL_HOLIDAY
-        self.add_holiday(date(self.year, 6, 24), "São João", type, True)
-        self.add_holiday(date(self.year, 7, 2), "Independência da Bahia", type, True)
-        self.add_holiday(date(self.year, 12, 8), "Nossa Senhora da Conceição", type, True)
-
-    
-    def init_navegantes_holidays(self):
-        """Adds the dates of local holidays in Navegantes/SC"""
-        type = HolidayType.LOCAL_HOLIDAY
-        self.add_holiday(date(self.year, 2, 2), "Nossa Senhora dos Navegantes", type, True)
-        self.add_holiday(date(self.year, 8, 26), "Aniversário de Navegantes", type, True)
+        self.add_rules(self.rules.city(city_type).holidays)
 
 
     def holiday_days_diff_date(self, reason: str, days: int=0):
@@ -200,25 +425,55 @@ class Holidays:
         Returns:
             Date: Date with offset.
         """
-        dict_data = next((item for item in self.holidays if item['reason'] == reason), None)
-        if dict_data:
+        record = self.by_reason.get(reason)
+        if record:
             if days:
-                return dict_data['date'] + timedelta(days=days)
+                return date.fromordinal(record.ordinal + days)
             
-            return dict_data['date']
+            return record.date
 
 
     def holiday_dict_by_date(self, date: date):
-        """Returns the data dictionary for a specific date.
+        """Returns the holiday records for a specific date.
 
         Arguments:
-            date (date): Date to search for the day in the list of holiday dictionaries.
+            date (date): Date to search for the day in the list of holidays.
 
         Returns:
-            dict list: List of holiday dictionaries for the day.
+            HolidayRecord list: List of holidays of the day.
         """
-        dict_list = list(item for item in self.holidays if item['date'] == date)
-        return dict_list
+        return self.holiday_on(date)
+
+
+    def holiday_on(self, date: date) -> List[HolidayRecord]:
+        """Returns the holidays of a specific date, using the date index.
+
+        Arguments:
+            date (date): Date to search for.
+
+        Returns:
+            HolidayRecord list: List of holidays of the day, in insertion order.
+        """
+        if date is None:
+            return []
+        return list(self.by_ordinal.get(date.toordinal(), ()))
+
+
+    def holidays_between(self, start_date: date, end_date: date) -> List[HolidayRecord]:
+        """Returns the sorted holidays between two dates, using a binary search.
+
+        Arguments:
+            start_date (date): First date of the range.
+            end_date (date): Last date of the range (inclusive).
+
+        Returns:
+            HolidayRecord list: Sorted list of holidays of the range, a tuple on the frozen instances.
+        """
+        views = self.sorted_views()
+        ordinals = views['ordinals']
+        first = bisect_left(ordinals, start_date.toordinal())
+        last = bisect_right(ordinals, end_date.toordinal())
+        return views['all'][first:last]
 
 
     def add_bridge_day(self, reason: str, type: HolidayType, is_local: bool):
@@ -233,79 +488,82 @@ class Holidays:
             date = self.holiday_days_diff_date(reason, days)
             holiday_date = self.holiday_dict_by_date(date)
             if date and date.weekday() in [0, 4] and not holiday_date:
-                self.add_holiday(date, "Dia ponte", type, is_local)
+                self.add_holiday(date, self.rules.bridge_reason, type, is_local)
                 break
     
 
     def init_administrative_decisions(self):
-        """Adds administrative decisions to the list of public holidays.
+        """Adds administrative decisions to the list of public holidays: the rules of the
+        administrative layer and the bridge days, decided by `resolve_bridge_days` in one
+        sweep over the sorted holidays.
         """
         type = HolidayType.ADMINISTRATIVE_DECISION
 
-        christmas_eve = datetime(self.year, 12, 24).date()
-        # if christmas_eve.weekday() in [0, 4]:
-        self.add_holiday(christmas_eve, "Véspera de Natal", type)
+        # Christmas Eve and New Year's Eve
+        self.add_rules(self.rules.administrative)
 
-        new_years_eve = datetime(self.year, 12, 31).date()
-        # if new_years_eve.weekday() == 4:
-        self.add_holiday(new_years_eve, "Véspera de Ano Novo", type)
+        # The administrative decisions and the excluded reasons do not generate bridge days
+        views = self.sorted_views()
+        items = views['all']
+        type_code = type.code
+        eligible = [item.type_code != type_code and item.reason not in self.bridge_excluded
+                    for item in items]
+        for index, ordinal in resolve_bridge_days(views['ordinals'], eligible):
+            self.add_record(HolidayRecord(ordinal,
+                                          self.rules.bridge_reason,
+                                          type_code,
+                                          items[index].is_local))
 
-        reasons_excl = ["Ano Novo", 
-                        "Natal", 
-                        "Carnaval", 
-                        "Cinzas", 
-                        "Paixão de Cristo"]
-        
-        for holiday in self.holidays:
-            if holiday['type'] == type:
-                continue # if the public holiday type is Administrative Decision, it does not generate another bridge day.
 
-            if holiday['date'].weekday() > 4:
-                continue # if the day is saturday or sunday, the next holiday, as there will be no bridge day.
+    def sorted_views(self) -> dict:
+        """Returns the cached sorted views of the holidays, rebuilding them if a holiday was added.
 
-            reason = holiday['reason']
-            is_local = holiday['is_local']
-            if reason not in reasons_excl:
-                self.add_bridge_day(reason, type, is_local)
+        Returns:
+            dict: Sorted lists `all`, `local` and `national`, and the date `ordinals` of `all`.
+        """
+        views = self.views
+        if views is None:
+            items = sorted(self.holidays, key=lambda i: i.ordinal)
+            views = {"all": items,
+                     "local": [item for item in items if item.is_local],
+                     "national": [item for item in items if not item.is_local],
+                     "ordinals": [item.ordinal for item in items]}
+            self.views = views
+        return views
 
 
     @property
-    def sorted(self) -> List[dict]:
+    def sorted(self) -> List[HolidayRecord]:
         """Property that returns all sorted dates.
 
         Return:
-            dict list: Dictionary list of holidays.
+            HolidayRecord list: List of holidays, a tuple on the frozen instances.
         """
-        my_time = datetime.min.time()
-        items = sorted(self.holidays, \
-            key = lambda i: (datetime.combine(i["date"], my_time)))
-        return items
+        return self.sorted_views()['all']
     
     @property
-    def sorted_local(self) -> List[dict]:
+    def sorted_local(self) -> List[HolidayRecord]:
         """Property that returns all local sorted dates.
 
         Return:
-            dict list: Dictionary list of holidays.
+            HolidayRecord list: List of holidays, a tuple on the frozen instances.
         """
-        items = self.sorted
-        local_items = [item for item in items if item['is_local']]
-        return local_items
+        return self.sorted_views()['local']
 
 
     @property
-    def sorted_national(self) -> List[dict]:
+    def sorted_national(self) -> List[HolidayRecord]:
         """Property that returns all local sorted dates.
 
         Return:
-            dict list: Dictionary list of holidays.
+            HolidayRecord list: List of holidays, a tuple on the frozen instances.
         """
-        items = self.sorted
-        national_items = [item for item in items if not item['is_local']]
-        return national_items
+        return self.sorted_views()['national']
 
 
 def test():
+    import pandas as pd
+
     # Teste da classe Feriados:
     #   - Imprimir os feriados de 2016 a 2022. 
     for year in range(2024, 2025):
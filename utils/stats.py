@@ -0,0 +1,510 @@
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from logging.handlers import RotatingFileHandler
+from typing import Any, List, Optional, Union, Callable
+
+import cProfile
+import json
+import logging
+import os
+import threading
+import time
+
+from db.log_writer import log_writer
+from db.models import LogType
+from utils.utils import root_path
+
+stats_file = os.environ.get('LACTEC_STATS_FILE', os.path.join(root_path, 'stats.json'))
+"""File where the statistics are dumped."""
+dump_interval = float(os.environ.get('LACTEC_STATS_INTERVAL', '60'))
+"""Seconds between two dumps of the statistics."""
+trace_file = os.environ.get('LACTEC_TRACE_FILE', os.path.join(root_path, 'trace.log'))
+"""Rotating file where each handler call, span and slow query is written as a JSON line."""
+trace_max_bytes = int(os.environ.get('LACTEC_TRACE_MAX_BYTES', str(10 * 1024 * 1024)))
+"""Size of the trace file before it is rotated."""
+trace_backups = int(os.environ.get('LACTEC_TRACE_BACKUPS', '5'))
+"""Number of rotated trace files kept."""
+slow_query_time = float(os.environ.get('LACTEC_SLOW_QUERY_MS', '100')) / 1000
+"""Seconds from which a query is logged as slow."""
+profile_session = os.environ.get('LACTEC_PROFILE_SESSION')
+"""Id of the session whose handlers are profiled with cProfile, or `next` for the next
+session that connects."""
+profile_path = os.environ.get('LACTEC_PROFILE_DIR', root_path)
+"""Folder where the profile of the session is dumped (`profile_<session id>.prof`)."""
+SUPPORTED_FLET = '0.23.'
+"""Flet versions whose private page connection `Stats.attach` wraps to measure the
+commands sent."""
+
+
+class HandlerStats:
+    """Aggregated cost of the calls of a UI handler or span."""
+    fields = ('calls', 'wall_time', 'build_time', 'send_time', 'db_time',
+              'max_wall_time', 'controls_created', 'updates', 'bytes_sent',
+              'queries', 'slow_queries')
+
+    def __init__(self):
+        for field in self.fields:
+            setattr(self, field, 0)
+
+
+    def add(self, record: dict):
+        """Adds the cost of a call.
+
+        Arguments:
+            record (dict): Cost of the call, see `Stats.begin`.
+        """
+        build_time = record['wall_time'] - record['send_time'] - record['db_time']
+        self.calls += 1
+        self.wall_time += record['wall_time']
+        self.build_time += max(build_time, 0.0)
+        self.send_time += record['send_time']
+        self.db_time += record['db_time']
+        self.max_wall_time = max(self.max_wall_time, record['wall_time'])
+        self.controls_created += record['controls_created']
+        self.updates += record['updates']
+        self.bytes_sent += record['bytes_sent']
+        self.queries += record['queries']
+        self.slow_queries += record['slow_queries']
+
+
+    def as_dict(self) -> dict:
+        """Returns the totals and the averages per call."""
+        data = {field: getattr(self, field) for field in self.fields}
+        if self.calls:
+            for field in ('wall_time', 'build_time', 'send_time', 'db_time',
+                          'controls_created', 'bytes_sent', 'queries'):
+                data[f'avg_{field}'] = getattr(self, field) / self.calls
+        return data
+
+
+class Stats:
+    """Cost of each UI interaction: controls created, bytes sent by `update()`, and wall
+    time spent building, sending and on the database. Aggregated by session and for the
+    whole process.
+
+    Spans (`span`, `traced`) measure the functions called by the handlers, such as
+    `session_scope` or `get_config`, and are aggregated under their own name. Tracing
+    also writes every handler call, span and slow query to the rotating `trace_file`,
+    and the handlers of the `profile_session` are profiled with cProfile.
+
+    Disabled by default; `enable()` turns it on, which `main` does when the environment
+    variable `LACTEC_STATS` or `LACTEC_TRACE` is set.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.process = {}
+        """Statistics of the process, by handler name."""
+        self.sessions = {}
+        """Statistics of each session, by session id and handler name."""
+        self.slow_queries = deque(maxlen=100)
+        """Last slow queries, with the handlers that executed them."""
+        self.trace_logger = None
+        self.profile_session = profile_session
+        self.profiles = {}
+        """cProfile of the profiled session, by session id."""
+        self.profile_lock = threading.Lock()
+        """Only one thread can be profiled at a time."""
+        self.control_init = None
+        """Original `ft.Control.__init__`, restored by `disable`."""
+        self.listeners = []
+        """(engine, event name, function) of the query listeners, removed by `disable`."""
+        self.send_warned = False
+        """If it was logged that the commands sent can not be measured."""
+        self.timer = None
+
+
+    def enable(self, engine=None, trace: bool = False):
+        """Turns the instrumentation on and starts dumping the statistics periodically.
+
+        Arguments:
+            engine (Engine, optional): Database engine whose queries are timed.
+            trace (bool, optional): If the calls are also written to `trace_file`.
+        """
+        if self.enabled:
+            return
+        self.enabled = True
+        if trace:
+            self.start_trace()
+        self.count_created_controls()
+        if engine is not None:
+            self.time_queries(engine)
+        self.schedule_dump()
+
+
+    def disable(self):
+        """Turns the instrumentation off: restores `ft.Control.__init__`, removes the
+        query listeners and stops the dumps and the trace. The statistics are kept.
+        """
+        if not self.enabled:
+            return
+        self.enabled = False
+        if self.control_init is not None:
+            import flet as ft
+
+            ft.Control.__init__ = self.control_init
+            self.control_init = None
+        if self.listeners:
+            from sqlalchemy import event
+
+            for engine, name, listener in self.listeners:
+                event.remove(engine, name, listener)
+            self.listeners = []
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.trace_logger is not None:
+            for handler in list(self.trace_logger.handlers):
+                self.trace_logger.removeHandler(handler)
+                handler.close()
+            self.trace_logger = None
+
+
+    def start_trace(self, file_name: Optional[str] = None):
+        """Writes the calls to a rotating file, one JSON object by line.
+
+        Arguments:
+            file_name (str, optional): The file. The default is `trace_file`.
+        """
+        handler = RotatingFileHandler(file_name or trace_file,
+                                      maxBytes=trace_max_bytes,
+                                      backupCount=trace_backups,
+                                      encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger = logging.getLogger('lactec.trace')
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        logger.addHandler(handler)
+        self.trace_logger = logger
+
+
+    def trace(self, data: dict):
+        """Writes an entry to the trace file, if tracing is on."""
+        if self.trace_logger is not None:
+            self.trace_logger.info(json.dumps(data, default=str))
+
+
+    def count_created_controls(self):
+        """Counts every Flet control created during a handler."""
+        import flet as ft
+
+        if self.control_init is not None:
+            return
+        init = ft.Control.__init__
+        self.control_init = init
+
+        @wraps(init)
+        def counting_init(control, *args, **kwargs):
+            init(control, *args, **kwargs)
+            for record in self.records():
+                record['controls_created'] += 1
+
+        ft.Control.__init__ = counting_init
+
+
+    def time_queries(self, engine):
+        """Measures the time and counts the queries executed during a handler, and logs
+        the queries slower than `slow_query_time` with the handlers that executed them.
+
+        Arguments:
+            engine (Engine): Database engine.
+        """
+        from sqlalchemy import event
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            context.stats_start = time.perf_counter()
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            elapsed = time.perf_counter() - context.stats_start
+            records = self.records()
+            is_slow = elapsed >= slow_query_time
+            for record in records:
+                record['db_time'] += elapsed
+                record['queries'] += 1
+                record['slow_queries'] += is_slow
+            if is_slow:
+                entry = {'date_hour': datetime.now().isoformat(timespec='seconds'),
+                         'event': 'slow_query',
+                         'handlers': [record['name'] for record in records],
+                         'seconds': elapsed,
+                         'statement': statement[:500]}
+                with self.lock:
+                    self.slow_queries.append(entry)
+                self.trace(entry)
+
+        self.listeners += [(engine, 'before_cursor_execute', before_cursor_execute),
+                           (engine, 'after_cursor_execute', after_cursor_execute)]
+
+
+    def attach(self, page):
+        """Measures the commands sent to the client of the page.
+
+        Arguments:
+            page (Page): Page of the session.
+        """
+        if not self.enabled:
+            return
+        if self.profile_session == 'next':
+            self.profile_session = str(page.session_id)
+
+        from flet.version import version
+
+        # The connection is a private attribute of the page in Flet 0.23
+        conn = getattr(page, '_Page__conn', None) if version.startswith(SUPPORTED_FLET) else None
+        if conn is None:
+            if not self.send_warned:
+                self.send_warned = True
+                log_writer.write(LogType.WARNING,
+                                 f'Estatísticas: conexão da página não encontrada no Flet {version} '
+                                 f'(suportado: {SUPPORTED_FLET}x); os comandos enviados não são medidos.')
+            return
+        if getattr(conn, 'stats_attached', False):
+            return
+
+        from flet_core.protocol import CommandEncoder
+
+        def measured(send):
+            @wraps(send)
+            def wrapper(session_id, commands):
+                records = self.records()
+                if not records:
+                    return send(session_id, commands)
+
+                size = len(json.dumps(commands, cls=CommandEncoder, separators=(',', ':')))
+                start = time.perf_counter()
+                try:
+                    return send(session_id, commands)
+                finally:
+                    elapsed = time.perf_counter() - start
+                    for record in records:
+                        record['updates'] += 1
+                        record['bytes_sent'] += size
+                        record['send_time'] += elapsed
+            return wrapper
+
+        conn.send_commands = measured(conn.send_commands)
+        conn.send_command = measured(conn.send_command)
+        conn.stats_attached = True
+
+
+    def records(self) -> List[dict]:
+        """Returns the records of the handlers running on this thread."""
+        return getattr(self.local, 'stack', [])
+
+
+    def begin(self, name: str, session_id: Any) -> dict:
+        """Starts the record of a handler call.
+
+        Arguments:
+            name (str): Name of the handler.
+            session_id: Id of the session of the call.
+
+        Returns:
+            dict: The record, which nested handlers also update.
+        """
+        stack = self.records()
+        record = {'name': name,
+                  'session_id': session_id,
+                  'parent': stack[-1]['name'] if stack else None,
+                  'start': time.perf_counter(),
+                  'wall_time': 0.0,
+                  'send_time': 0.0,
+                  'db_time': 0.0,
+                  'controls_created': 0,
+                  'updates': 0,
+                  'bytes_sent': 0,
+                  'queries': 0,
+                  'slow_queries': 0}
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        self.local.stack.append(record)
+        return record
+
+
+    def end(self, record: dict):
+        """Finishes the record of a handler call and aggregates it.
+
+        Arguments:
+            record (dict): Record returned by `begin`.
+        """
+        record['wall_time'] = time.perf_counter() - record['start']
+        self.local.stack.remove(record)
+        with self.lock:
+            name = record['name']
+            self.process.setdefault(name, HandlerStats()).add(record)
+            if record['session_id'] is not None:
+                session = self.sessions.setdefault(str(record['session_id']), {})
+                session.setdefault(name, HandlerStats()).add(record)
+        self.trace({'date_hour': datetime.now().isoformat(timespec='seconds'),
+                    'event': 'call',
+                    'name': name,
+                    'parent': record['parent'],
+                    'session_id': record['session_id'],
+                    'wall_time': record['wall_time'],
+                    'db_time': record['db_time'],
+                    'queries': record['queries'],
+                    'slow_queries': record['slow_queries']})
+
+
+    @contextmanager
+    def span(self, name: str):
+        """Records the cost of a block, such as a function called by the handlers, in
+        the session of the handler running on this thread.
+
+        Arguments:
+            name (str): Name of the span in the statistics.
+        """
+        if not self.enabled:
+            yield None
+            return
+
+        stack = self.records()
+        record = self.begin(name, stack[-1]['session_id'] if stack else None)
+        try:
+            yield record
+        finally:
+            self.end(record)
+
+
+    def profiled(self, session_id: Any, function: Callable, *args, **kwargs):
+        """Calls a function, profiling it if it belongs to the `profile_session`.
+
+        Arguments:
+            session_id: Id of the session of the call.
+            function (callable): The function.
+
+        Returns:
+            The result of the function.
+        """
+        if self.profile_session is None or str(session_id) != self.profile_session or \
+                not self.profile_lock.acquire(blocking=False):
+            return function(*args, **kwargs)
+
+        try:
+            profile = self.profiles.setdefault(str(session_id), cProfile.Profile())
+            profile.enable()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profile.disable()
+        finally:
+            self.profile_lock.release()
+
+
+    def dump_profiles(self):
+        """Writes the profile of each profiled session to `profile_path`, to be read
+        with `pstats` or snakeviz."""
+        with self.profile_lock:
+            for session_id, profile in self.profiles.items():
+                profile.dump_stats(os.path.join(profile_path, f'profile_{session_id}.prof'))
+
+
+    def end_session(self, session_id: Any):
+        """Discards the statistics of a closed session. The process totals are kept.
+
+        Arguments:
+            session_id: Id of the session.
+        """
+        with self.lock:
+            self.sessions.pop(str(session_id), None)
+        if str(session_id) in self.profiles:
+            self.dump_profiles()
+
+
+    def snapshot(self) -> dict:
+        """Returns the statistics of the process and of each session."""
+        with self.lock:
+            return {
+                'date_hour': datetime.now().isoformat(timespec='seconds'),
+                'process': {name: item.as_dict() for name, item in self.process.items()},
+                'sessions': {session_id: {name: item.as_dict() for name, item in handlers.items()}
+                             for session_id, handlers in self.sessions.items()},
+                'slow_queries': list(self.slow_queries),
+            }
+
+
+    def dump(self, file_name: Optional[str] = None):
+        """Writes the statistics to a JSON file.
+
+        Arguments:
+            file_name (str, optional): The file. The default is `stats_file`.
+        """
+        file_name = file_name or stats_file
+        temp_name = f'{file_name}.tmp'
+        with open(temp_name, mode='w', encoding='utf-8') as file_ref:
+            json.dump(self.snapshot(), file_ref, indent=2)
+        os.replace(temp_name, file_name)
+        if self.profiles:
+            self.dump_profiles()
+
+
+    def schedule_dump(self):
+        """Dumps the statistics every `dump_interval` seconds."""
+        def run():
+            try:
+                self.dump()
+            except Exception as e:
+                import db.database as db
+
+                db.save_log_message(None, LogType.ERROR, e)
+            if self.enabled:
+                self.schedule_dump()
+
+        self.timer = threading.Timer(dump_interval, run)
+        self.timer.daemon = True
+        self.timer.start()
+
+
+stats = Stats()
+"""Statistics shared by the whole process."""
+
+
+def instrumented(name: str):
+    """Decorator that records the cost of a UI handler in `stats`.
+
+    The handler must be a method of an object with a `page` attribute. Nothing is
+    recorded while the statistics are disabled.
+
+    Arguments:
+        name (str): Name of the handler in the statistics.
+    """
+    def decorator(handler: Callable):
+        @wraps(handler)
+        def wrapper(self, *args, **kwargs):
+            if not stats.enabled:
+                return handler(self, *args, **kwargs)
+
+            page = getattr(self, 'page', None)
+            session_id = getattr(page, 'session_id', None)
+            record = stats.begin(name, session_id)
+            try:
+                return stats.profiled(session_id, handler, self, *args, **kwargs)
+            finally:
+                stats.end(record)
+        return wrapper
+    return decorator
+
+
+def traced(name: str):
+    """Decorator that records the cost of a function in `stats`, as a span of the
+    handler that called it (see `Stats.span`). Nothing is recorded while the
+    statistics are disabled.
+
+    Arguments:
+        name (str): Name of the function in the statistics.
+    """
+    def decorator(function: Callable):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not stats.enabled:
+                return function(*args, **kwargs)
+
+            with stats.span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,7 +1,9 @@
+from collections import OrderedDict
 from typing import Any, List, Optional, Union, Callable
 
 import os
 import sys
+import threading
 
 this_path = os.path.abspath(os.path.dirname(__file__))
 root_path = os.path.abspath(os.path.join(this_path, '..'))
@@ -21,3 +23,104 @@ def error_handling(e):
 
 def search_by_key(data: List[dict], key: str, value: Any) -> list[dict]:
     return [item for item in data if key in item and item[key] == value]
+
+
+class LRUCache:
+    """Thread-safe, size-bounded cache that evicts the least recently used item.
+
+    Arguments:
+        maxsize (int): Maximum number of items kept in the cache.
+    """
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+
+    def get(self, key, default=None):
+        """Returns the cached value of the key, marking it as recently used.
+
+        Arguments:
+            key: Key of the item.
+            default (optional): Value returned on a miss. The default is `None`.
+        """
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return self.items[key]
+            self.misses += 1
+            return default
+
+
+    def __contains__(self, key) -> bool:
+        """Checks if the key is cached, without marking it as used or counting a hit."""
+        with self.lock:
+            return key in self.items
+
+
+    def put(self, key, value):
+        """Stores a value, evicting the least recently used items beyond `maxsize`.
+
+        Arguments:
+            key: Key of the item.
+            value: Value of the item.
+        """
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+
+    def get_or_create(self, key, factory: Callable[[], Any]):
+        """Returns the cached value of the key, creating and storing it on a miss.
+
+        Arguments:
+            key: Key of the item.
+            factory (Callable): Function without arguments that creates the value.
+        """
+        value = self.get(key, self)
+        if value is self:
+            value = factory()
+            self.put(key, value)
+        return value
+
+
+    def pop(self, key, default=None):
+        """Removes the key from the cache, returning its value.
+
+        Arguments:
+            key: Key of the item.
+            default (optional): Value returned if the key is not cached.
+        """
+        with self.lock:
+            return self.items.pop(key, default)
+
+
+    def evict(self, predicate: Callable[[Any], bool]):
+        """Removes the items whose key matches the predicate.
+
+        Arguments:
+            predicate (Callable): Function that receives a key and returns `True` to remove it.
+        """
+        with self.lock:
+            for key in [key for key in self.items if predicate(key)]:
+                del self.items[key]
+
+
+    def clear(self):
+        """Removes all items from the cache. The counters are kept."""
+        with self.lock:
+            self.items.clear()
+
+
+    def info(self) -> dict:
+        """Returns the cache statistics: hits, misses, current size and maximum size."""
+        with self.lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "size": len(self.items),
+                    "maxsize": self.maxsize}